@@ -1,14 +1,18 @@
+import json
+
 import streamlit as st
-import requests
 import pandas as pd
-import folium
-import random
-from shapely.geometry import MultiPoint, Polygon
-from io import BytesIO  # Para el manejo del Excel en memoria
-from sklearn.cluster import KMeans
-from geopy.distance import geodesic
-import numpy as np
-from pyproj import Transformer
+
+from geo_agent import instrumentation, pipeline
+from geo_agent.boundary_store import BoundaryStore
+from geo_agent.export import FORMATS, export_bytes
+from geo_agent.net import post_json
+from geo_agent.overpass import OVERPASS_URL, OfflineCacheMiss
+from geo_agent.rendering import MAP_MODES, render_map_html
+from geo_agent.routing import MATRIX_MAX_SIZE
+from geo_agent.schedule import WEEKDAYS, generate_schedule, parse_holidays
+from geo_agent.shared_cache import shared_cache
+from geo_agent.territory import TerritoryIndex, load_territory_index
 
 # -------------------------------
 # Estilos personalizados (tema oscuro)
@@ -94,9 +98,7 @@ def get_municipios(provincia):
     rel(area.provincia)["admin_level"="8"]["boundary"="administrative"];
     out tags;
     """
-    url = "http://overpass-api.de/api/interpreter"
-    response = requests.post(url, data={'data': query})
-    data = response.json()
+    data = post_json(OVERPASS_URL, data={'data': query})
     municipios = [element.get("tags", {}).get("name") for element in data.get("elements", []) if element.get("tags", {}).get("name")]
     return sorted(list(set(municipios)))
 
@@ -110,279 +112,107 @@ def get_distritos(municipio):
     rel(area.municipio)["admin_level"="9"]["boundary"="administrative"];
     out tags;
     """
-    url = "http://overpass-api.de/api/interpreter"
-    response = requests.post(url, data={'data': query})
-    data = response.json()
+    data = post_json(OVERPASS_URL, data={'data': query})
     distritos = [element.get("tags", {}).get("name") for element in data.get("elements", []) if element.get("tags", {}).get("name")]
     return sorted(list(set(distritos)))
 
 # -------------------------------
-# Constantes para GeoJSON y archivo Excel de división territorial
+# Funciones para cargar los límites desde el almacén local
 # -------------------------------
-DIVISION_XLSX_URL = "https://raw.githubusercontent.com/DataPicasso/geo-agent/main/division_territorial.xlsx"
+@st.cache_resource
+def get_boundary_store():
+    return BoundaryStore()
+
+def get_boundary(territory):
+    # territory: (Provincia, Municipio, Distrito, Sección, Barrio); el perímetro se comparte entre sesiones
+    boundary = pipeline.cached_boundary(territory, store=get_boundary_store(), on_error=st.error)
+    if boundary is None and territory[0] and territory[0] != "Todos":
+        st.warning(f"No se encontró el perímetro para la provincia: {territory[0]}")
+    return boundary
 
-# Para municipios, distritos, secciones y barrios se siguen usando estos URLs:
-PROVINCE_GEOJSON_URL = "https://geoportal.iderd.gob.do/geoserver/ows?service=WFS&version=1.0.0&request=GetFeature&typename=geonode%3ARD_PROV&outputFormat=json&srs=EPSG%3A32619&srsName=EPSG%3A32619"
-MUNICIPIO_GEOJSON_URL = "https://geoportal.iderd.gob.do/geoserver/ows?service=WFS&version=1.0.0&request=GetFeature&typename=geonode%3ARD_MUNICIPIOS&outputFormat=json&srs=EPSG%3A32619&srsName=EPSG%3A32619"
-DISTRITO_GEOJSON_URL = "https://geoportal.iderd.gob.do/geoserver/ows?service=WFS&version=1.0.0&request=GetFeature&typename=geonode%3ARD_DM&outputFormat=json&srs=EPSG%3A32619&srsName=EPSG%3A32619"
-SECCION_GEOJSON_URL = "https://geoportal.iderd.gob.do/geoserver/ows?service=WFS&version=1.0.0&request=GetFeature&typename=geonode%3ARD_SECCIONES&outputFormat=json&srs=EPSG%3A32619&srsName=EPSG%3A32619"
-BARRIOS_PARAJES_URL = "https://geoportal.iderd.gob.do/geoserver/ows?service=WFS&version=1.0.0&request=GetFeature&typename=geonode%3ARD_BPARAJES&outputFormat=json&srs=EPSG%3A32619&srsName=EPSG%3A32619"
+@st.cache_resource
+def get_street_fetcher():
+    return pipeline.open_street_source()
 
-# -------------------------------
-# Funciones para cargar y filtrar GeoJSON
-# -------------------------------
-def load_geojson(url):
+def get_street_set(territory, boundary):
+    # Las calles se piden por teselas fijas que quedan en caché en disco y luego se recortan al perímetro;
+    # el conjunto columnar resultante se comparte en memoria entre sesiones
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        return response.json()
+        return pipeline.cached_street_set(territory, boundary, get_street_fetcher())
+    except OfflineCacheMiss as e:
+        st.error(f"Sin conexión: {e}")
     except Exception as e:
-        st.error(f"Error al cargar GeoJSON desde {url}: {e}")
-    return {}
-
-def filter_feature(geojson_data, value):
-    for feature in geojson_data.get("features", []):
-        props = feature.get("properties", {})
-        if "TOPONIMIA" in props and props["TOPONIMIA"].strip().upper() == value.strip().upper():
-            return feature
+        st.error(f"Error al consultar Overpass API con el perímetro: {e}")
     return None
 
-def get_boundary(selected_prov, selected_muni, selected_dist, selected_secc, selected_barrio):
-    boundary = None
-    if selected_barrio and selected_barrio != "Todos":
-        data = load_geojson(BARRIOS_PARAJES_URL)
-        feature = filter_feature(data, selected_barrio)
-        if feature:
-            boundary = feature.get("geometry")
-    if not boundary and selected_secc and selected_secc != "Todos":
-        data = load_geojson(SECCION_GEOJSON_URL)
-        feature = filter_feature(data, selected_secc)
-        if feature:
-            boundary = feature.get("geometry")
-    if not boundary and selected_dist and selected_dist != "Todos":
-        data = load_geojson(DISTRITO_GEOJSON_URL)
-        feature = filter_feature(data, selected_dist)
-        if feature:
-            boundary = feature.get("geometry")
-    if not boundary and selected_muni and selected_muni != "Todos":
-        data = load_geojson(MUNICIPIO_GEOJSON_URL)
-        feature = filter_feature(data, selected_muni)
-        if feature:
-            boundary = feature.get("geometry")
-    if not boundary and selected_prov and selected_prov != "Todos":
-        boundary = get_province_boundary(selected_prov)
-    return boundary
+def get_assignment(request):
+    # request: {"territorio": ..., "agentes": ..., "backend": ..., "motor": ...}, lo único que se guarda en la sesión.
+    # Si la asignación salió de la caché por falta de memoria, se recalcula a partir de las cachés en disco.
+    territory = request["territorio"]
 
-# Para provincias, usamos el GeoJSON de GitHub y comparamos con la propiedad "name"
-def get_province_boundary(provincia):
-    PROVINCIAS_GEOJSON_URL = "https://raw.githubusercontent.com/DataPicasso/geo-agent/main/provincias.geojson"
-    data = load_geojson(PROVINCIAS_GEOJSON_URL)
-    if data:
-        for feature in data.get("features", []):
-            props = feature.get("properties", {})
-            if "name" in props and props["name"].strip().lower() == provincia.strip().lower():
-                return feature.get("geometry")
-    st.warning(f"No se encontró el perímetro para la provincia: {provincia}")
-    return None
+    def load():
+        boundary = get_boundary(territory)
+        return boundary, get_street_set(territory, boundary) if boundary else None
 
-def build_overpass_query_polygon(geometry):
-    # Si la geometría es MultiPolygon, usamos el primer polígono
-    if geometry["type"] == "MultiPolygon":
-        geometry = {"type": "Polygon", "coordinates": geometry["coordinates"][0]}
-    if geometry["type"] != "Polygon":
-        return ""
-    
-    # Verificar si las coordenadas ya están en lat/lon (EPSG:4326)
-    # Si el primer punto tiene latitud entre -90 y 90, asumimos EPSG:4326
-    first_coord = geometry["coordinates"][0][0]
-    if -90 <= first_coord[1] <= 90 and -180 <= first_coord[0] <= 180:
-        coords = [f"{pt[1]} {pt[0]}" for pt in geometry["coordinates"][0]]
-    else:
-        # En otro caso, asumimos que están en EPSG:32619 y se transforman a 4326
-        transformer = Transformer.from_crs("EPSG:32619", "EPSG:4326", always_xy=True)
-        coords = []
-        for coord in geometry["coordinates"][0]:
-            lon, lat = transformer.transform(coord[0], coord[1])
-            coords.append(f"{lat} {lon}")
-    poly_string = " ".join(coords)
-    query = f"""
-    [out:json][timeout:25];
-    (
-      way["highway"]["name"](poly:"{poly_string}");
-    );
-    out geom;
-    """
-    return query
+    return pipeline.cached_assignment(territory, request["agentes"], request["backend"], request["motor"], load=load)
 
-def get_streets_by_polygon(boundary):
-    url = "http://overpass-api.de/api/interpreter"
-    query = build_overpass_query_polygon(boundary)
-    if not query:
-        return None
-    try:
-        response = requests.post(url, data={'data': query})
-        response.raise_for_status()
-        data = response.json()
-        if data.get("elements"):
-            return data["elements"]
-    except Exception as e:
-        st.error(f"Error al consultar Overpass API con el perímetro: {e}")
-    return None
+def get_assignment_table(result, territory):
+    return pipeline.cached_table(result, territory)
 
 # -------------------------------
 # Funciones para asignación, clustering y mapeo
 # -------------------------------
-def calculate_centroid(geometry):
-    lats = [point["lat"] for point in geometry]
-    lons = [point["lon"] for point in geometry]
-    return sum(lats) / len(lats), sum(lons) / len(lons)
-
-def assign_streets_cluster(streets, num_agents):
-    data = []
-    indices = []
-    for idx, street in enumerate(streets):
-        if "geometry" in street and len(street["geometry"]) > 0:
-            lat, lon = calculate_centroid(street["geometry"])
-            data.append([lat, lon])
-            indices.append(idx)
-    if not data:
-        return {}
-    data = np.array(data)
-    kmeans = KMeans(n_clusters=num_agents, n_init=10, random_state=42).fit(data)
-    labels = kmeans.labels_
-    assignments = {i: [] for i in range(num_agents)}
-    for label, idx in zip(labels, indices):
-        assignments[label].append(streets[idx])
-    return assignments
-
-def reorder_cluster(cluster_streets):
-    if len(cluster_streets) < 2:
-        return cluster_streets
-    ordered = [cluster_streets.pop(0)]
-    while cluster_streets:
-        last = ordered[-1]
-        last_coord = calculate_centroid(last["geometry"]) if "geometry" in last and len(last["geometry"]) > 0 else None
-        if not last_coord:
-            break
-        best = None
-        best_dist = float('inf')
-        best_index = None
-        for i, street in enumerate(cluster_streets):
-            if "geometry" in street and len(street["geometry"]) > 0:
-                coord = calculate_centroid(street["geometry"])
-                d = geodesic(last_coord, coord).km
-                if d < best_dist:
-                    best_dist = d
-                    best = street
-                    best_index = i
-        if best is not None:
-            ordered.append(best)
-            cluster_streets.pop(best_index)
-        else:
-            break
-    return ordered
-
-def generate_agent_colors(num_agents):
-    colors = {}
-    for agent in range(1, num_agents+1):
-        colors[agent-1] = "#" + ''.join([random.choice('0123456789ABCDEF') for _ in range(6)])
-    return colors
-
-def create_map(assignments, mode, boundary, agent_colors):
-    if boundary and boundary["type"] == "Polygon":
-        lats = [pt[1] for pt in boundary["coordinates"][0]]
-        lons = [pt[0] for pt in boundary["coordinates"][0]]
-        center = [sum(lats)/len(lats), sum(lons)/len(lons)]
-    else:
-        center = [19.0, -70.0]
-    m = folium.Map(location=center, zoom_start=13, tiles="cartodbpositron")
-    for agent, streets in assignments.items():
-        streets_ordered = reorder_cluster(streets.copy())
-        feature_group = folium.FeatureGroup(name=f"Agente {agent+1}")
-        if mode == "Calles":
-            for street in streets_ordered:
-                if "geometry" in street:
-                    coords = [(pt["lat"], pt["lon"]) for pt in street["geometry"]]
-                    folium.PolyLine(
-                        coords,
-                        color=agent_colors.get(agent, "#000000"),
-                        weight=4,
-                        tooltip=street.get("tags", {}).get("name", "Sin nombre")
-                    ).add_to(feature_group)
-        elif mode == "Área":
-            points = []
-            for street in streets_ordered:
-                if "geometry" in street:
-                    for pt in street["geometry"]:
-                        points.append((pt["lon"], pt["lat"]))
-            if points:
-                try:
-                    polygon = MultiPoint(points).convex_hull
-                    if isinstance(polygon, Polygon):
-                        folium.GeoJson(
-                            data={
-                                "type": "Feature",
-                                "geometry": {
-                                    "type": "Polygon",
-                                    "coordinates": [list(polygon.exterior.coords)]
-                                }
-                            },
-                            style_function=lambda x, col=agent_colors.get(agent, "#000000"): {
-                                "fillColor": col,
-                                "color": col,
-                                "fillOpacity": 0.4
-                            }
-                        ).add_to(feature_group)
-                except Exception as e:
-                    st.error(f"Error al calcular el área para el Agente {agent+1}: {e}")
-        feature_group.add_to(m)
-    folium.LayerControl().add_to(m)
-    return m
-
-def generate_dataframe(assignments, selected_prov, selected_muni, selected_dist, selected_secc, selected_barrio):
-    rows = []
-    for agent, streets in assignments.items():
-        streets_ordered = reorder_cluster(streets.copy())
-        for street in streets_ordered:
-            name = street.get("tags", {}).get("name", "Sin nombre")
-            if "geometry" in street and len(street["geometry"]) > 0:
-                lat, lon = calculate_centroid(street["geometry"])
-            else:
-                lat, lon = None, None
-            rows.append({
-                "Calle": name,
-                "Provincia": selected_prov,
-                "Municipio": selected_muni,
-                "Distrito Municipal": selected_dist,
-                "Sección": selected_secc,
-                "Barrio": selected_barrio,
-                "País": "🇩🇴 República Dominicana",
-                "Latitud": lat,
-                "Longitud": lon,
-                "Agente": agent + 1
-            })
-    return pd.DataFrame(rows)
-
-def generate_schedule(df, working_days, start_date, rutas_por_dia):
-    schedule = {}
-    for agent in sorted(df["Agente"].unique()):
-        agent_df = df[df["Agente"] == agent].copy()
-        if "Order" in agent_df.columns:
-            agent_df = agent_df.sort_values("Order")
-        else:
-            agent_df = agent_df.reset_index(drop=True)
-        total_routes = len(agent_df)
-        required_days = int(np.ceil(total_routes / rutas_por_dia))
-        working_dates = []
-        current_date = pd.to_datetime(start_date)
-        while len(working_dates) < required_days:
-            if current_date.strftime("%A") in working_days:
-                working_dates.append(current_date)
-            current_date += pd.Timedelta(days=1)
-        groups = [agent_df.iloc[i*rutas_por_dia:(i+1)*rutas_por_dia] for i in range(required_days)]
-        schedule[agent] = [{"Date": date.strftime("%Y-%m-%d"), "Calles": group["Calle"].tolist()} 
-                           for date, group in zip(working_dates, groups)]
-    return schedule
+EXPORT_FORMATS = {
+    "Excel": "xlsx",
+    "CSV": "csv",
+    "Parquet": "parquet",
+}
+
+# Criterio de reparto de las calles de cada agente en días -> (modo, etiqueta de la carga diaria, valor por defecto)
+SCHEDULE_SPLITS = {
+    "Número de calles": ("calles", "Calles por día:", 10.0),
+    "Kilómetros de calle": ("km", "Km de calle por día:", 5.0),
+    "Tiempo estimado": ("minutos", "Minutos de trabajo por día:", 360.0),
+}
+
+# Distancia con la que se ordenan las calles de cada agente
+ROUTE_ENGINES = {
+    "Por la red de calles": "network",
+    "En línea recta": "auto",
+}
+
+CLUSTERING_BACKENDS = {
+    "Automático": "auto",
+    "KMeans": "kmeans",
+    "MiniBatch KMeans": "minibatch",
+    "Balanceado por longitud": "balanced",
+}
+
+def show_diagnostics(report):
+    st.subheader("Diagnóstico de la ejecución")
+    counters = report["contadores"]
+    resumen = f"Total: {report['segundos']:.2f} s · descargado: {counters.get('bytes_descargados', 0) / 2**20:.2f} MB en {counters.get('peticiones', 0)} peticiones"
+    if report["memoria_pico"] is not None:
+        resumen += f" · memoria pico (tracemalloc): {report['memoria_pico'] / 2**20:.1f} MB"
+    if report["rss_max"] is not None:
+        resumen += f" · RSS máximo del proceso: {report['rss_max'] / 2**20:.0f} MB"
+    st.caption(resumen)
+    etapas = pd.DataFrame({
+        # La sangría refleja las etapas anidadas
+        "Etapa": ["· " * stage["nivel"] + stage["etapa"] for stage in report["etapas"]],
+        "Segundos": [round(stage["segundos"], 3) for stage in report["etapas"]],
+        "Memoria pico (MB)": [stage["memoria_pico"] / 2**20 if "memoria_pico" in stage else None for stage in report["etapas"]],
+        "Contadores": [", ".join(f"{k}={v}" for k, v in stage["contadores"].items()) for stage in report["etapas"]],
+    })
+    st.dataframe(etapas, hide_index=True)
+    col_json, col_metrics = st.columns(2)
+    col_json.download_button("Descargar JSON", data=json.dumps(report, ensure_ascii=False, indent=2),
+                             file_name="diagnostico.json", mime="application/json")
+    col_metrics.download_button("Descargar OpenMetrics", data=instrumentation.report_openmetrics(report),
+                                file_name="diagnostico.txt", mime="application/openmetrics-text")
+    if report["perfil"]:
+        with st.expander("Perfil (cProfile)"):
+            st.code(report["perfil"])
 
 def update_provincia():
     st.session_state.municipio = None
@@ -392,40 +222,42 @@ def update_municipio():
     st.session_state.distrito = None
 
 # -------------------------------
-# Cargar el archivo Excel con la división territorial
+# Cargar la división territorial (índice jerárquico serializado a partir del Excel local)
 # -------------------------------
-@st.cache_data
-def load_division_excel():
+@st.cache_resource
+def load_division_index():
     try:
-        return pd.read_excel(DIVISION_XLSX_URL)
+        return load_territory_index()
     except Exception as e:
         st.error(f"Error al cargar el archivo Excel: {e}")
-        return pd.DataFrame()
+        return TerritoryIndex([])
 
-df_division = load_division_excel()
+territorios = load_division_index()
 
-# Crear listas dinámicas para cada nivel (cascada) a partir del Excel
-provincias_all = sorted(df_division["Provincia"].dropna().unique().tolist()) if "Provincia" in df_division.columns else []
+# Crear listas dinámicas para cada nivel (cascada) a partir del índice precalculado
+provincias_all = territorios.options("Provincia")
 selected_prov = st.sidebar.selectbox("Seleccione la Provincia:", ["Todos"] + provincias_all, index=0, key="provincia", on_change=update_provincia)
 
-df_prov = df_division[df_division["Provincia"] == selected_prov] if selected_prov != "Todos" else df_division
-municipios_all = sorted(df_prov["Municipio"].dropna().unique().tolist()) if "Municipio" in df_prov.columns else []
+municipios_all = territorios.options("Municipio", [selected_prov])
 selected_muni = st.sidebar.selectbox("Seleccione el Municipio:", ["Todos"] + municipios_all, index=0, key="municipio", on_change=update_municipio)
 
-df_muni = df_prov[df_prov["Municipio"] == selected_muni] if selected_prov != "Todos" and selected_muni != "Todos" else df_prov
-distritos_all = sorted(df_muni["Distrito Municipal"].dropna().unique().tolist()) if "Distrito Municipal" in df_muni.columns else []
+distritos_all = territorios.options("Distrito Municipal", [selected_prov, selected_muni])
 selected_dist = st.sidebar.selectbox("Seleccione el Distrito Municipal:", ["Todos"] + distritos_all, index=0, key="distrito")
 
-df_dist = df_muni[df_muni["Distrito Municipal"] == selected_dist] if selected_prov != "Todos" and selected_muni != "Todos" and selected_dist != "Todos" else df_muni
-secciones_all = sorted(df_dist["Sección"].dropna().unique().tolist()) if "Sección" in df_dist.columns else []
+secciones_all = territorios.options("Sección", [selected_prov, selected_muni, selected_dist])
 selected_secc = st.sidebar.selectbox("Seleccione la Sección:", ["Todos"] + secciones_all, index=0, key="seccion")
 
-df_secc = df_dist[df_dist["Sección"] == selected_secc] if selected_prov != "Todos" and selected_muni != "Todos" and selected_dist != "Todos" and selected_secc != "Todos" else df_dist
-barrios_all = sorted(df_secc["Barrio"].dropna().unique().tolist()) if "Barrio" in df_secc.columns else []
+barrios_all = territorios.options("Barrio", [selected_prov, selected_muni, selected_dist, selected_secc])
 selected_barrio = st.sidebar.selectbox("Seleccione el Barrio:", ["Todos"] + barrios_all, index=0, key="barrio")
 
 num_agents = st.sidebar.number_input("Número de agentes:", min_value=1, value=3, step=1)
-mode = st.sidebar.radio("Modo de visualización del mapa:", options=["Calles", "Área"])
+clustering_label = st.sidebar.selectbox("Método de agrupación:", options=list(CLUSTERING_BACKENDS.keys()), index=0)
+route_label = st.sidebar.selectbox("Distancia para ordenar las calles:", options=list(ROUTE_ENGINES.keys()), index=0)
+mode = st.sidebar.radio("Modo de visualización del mapa:", options=MAP_MODES)
+
+with st.sidebar.expander("Diagnóstico"):
+    mostrar_diagnostico = st.checkbox("Mostrar diagnóstico de la ejecución", value=False)
+    perfilar = st.checkbox("Perfilar la próxima ejecución (cProfile y tracemalloc)", value=False)
 
 st.title("GEO AGENT 🇩🇴: Organización Inteligente de Rutas en República Dominicana")
 st.markdown("Esta aplicación utiliza los límites administrativos definidos en GeoJSON (para Municipio, Distrito, Sección y Barrio) y la ubicación geoespacial de la Provincia obtenida de OpenStreetMap para filtrar dinámicamente el área en 🇩🇴 República Dominicana. Se extraen las calles desde OpenStreetMap dentro del perímetro seleccionado.")
@@ -433,67 +265,114 @@ st.markdown("Esta aplicación utiliza los límites administrativos definidos en
 if "resultado" not in st.session_state:
     st.session_state.resultado = None
 
-if st.sidebar.button("Generar asignación"):
-    boundary = get_boundary(selected_prov, selected_muni, selected_dist, selected_secc, selected_barrio)
-    st.session_state.boundary = boundary  # Almacena el boundary en el session state
-    if boundary:
+# Informe de tiempos y contadores de la ejecución iniciada con el botón (incluye mapa y tabla)
+run_report = None
+
+generar = st.sidebar.button("Generar asignación")
+if generar:
+    run_report = instrumentation.start_run("Generar asignación", profile=perfilar, trace_memory=perfilar)
+
+try:
+    if generar:
+        request = {
+            "territorio": (selected_prov, selected_muni, selected_dist, selected_secc, selected_barrio),
+            "agentes": int(num_agents),
+            "backend": CLUSTERING_BACKENDS[clustering_label],
+            "motor": ROUTE_ENGINES[route_label],
+        }
         with st.spinner("Consultando Overpass API para obtener calles dentro del perímetro..."):
-            streets = get_streets_by_polygon(boundary)
-        if streets:
-            assignments = assign_streets_cluster(streets, num_agents)
-            agent_colors = generate_agent_colors(num_agents)
-            mapa = create_map(assignments, mode, boundary, agent_colors)
-            df = generate_dataframe(assignments, selected_prov, selected_muni, selected_dist, selected_secc, selected_barrio)
-            order_list = []
-            for agent, streets_assigned in assignments.items():
-                streets_ordered = reorder_cluster(streets_assigned.copy())
-                for i, street in enumerate(streets_ordered):
-                    order_list.append(i+1)
-            if len(order_list) == len(df):
-                df["Order"] = order_list
-            st.session_state.resultado = {"mapa": mapa, "dataframe": df}
-            st.session_state.assignments = assignments
-            st.session_state.agent_colors = agent_colors
-        else:
-            st.session_state.resultado = None
-    else:
-        st.session_state.resultado = None
+            # Clustering y ordenamiento se calculan una sola vez; los reruns y otras sesiones sólo leen el resultado
+            result = get_assignment(request)
+        st.session_state.resultado = request if result is not None else None
 
-if st.session_state.resultado:
-    st.subheader("Filtro de Agente")
-    assignments_dict = st.session_state.get("assignments", {})
-    filtro_opciones = ["Todos"] + [str(i+1) for i in assignments_dict.keys()]
-    agente_filtrar = st.sidebar.selectbox("Filtrar por agente:", options=filtro_opciones, key="agent_filter")
+    result = get_assignment(st.session_state.resultado) if st.session_state.resultado else None
+
+    if result is not None:
+        st.subheader("Filtro de Agente")
+        filtro_opciones = ["Todos"] + [str(i+1) for i in result.agents]
+        agente_filtrar = st.sidebar.selectbox("Filtrar por agente:", options=filtro_opciones, key="agent_filter")
     
-    if agente_filtrar != "Todos":
-        agente_seleccionado = int(agente_filtrar) - 1
-        assignments_filtradas = { agente_seleccionado: assignments_dict.get(agente_seleccionado, []) }
-    else:
-        assignments_filtradas = assignments_dict
+        agentes_filtrados = [int(agente_filtrar) - 1] if agente_filtrar != "Todos" else None
     
-    mapa_filtrado = create_map(assignments_filtradas, mode, st.session_state.boundary, st.session_state.get("agent_colors", {}))
+        stats = result.meta.get("clustering")
+        if stats:
+            st.caption(
+                f"Agrupación ({stats['backend']}{', reajuste incremental' if stats.get('incremental') else ''}): "
+                f"{stats['segundos']:.2f} s · "
+                f"km medios por agente: {stats['km_medio']:.1f} · desbalance (máx/medio): {stats['desbalance']:.2f}"
+                + (f" · recorridos reutilizados: {result.meta['recorridos_reutilizados']}"
+                   if "recorridos_reutilizados" in result.meta else "")
+            )
+        en_linea_recta = [agent for agent, motor in result.meta.get("motores", {}).items() if motor != "network"]
+        if st.session_state.resultado["motor"] == "network" and en_linea_recta:
+            if result.meta.get("ordenamiento") == "auto":
+                st.caption(f"Con más de {pipeline.NETWORK_MAX_STREETS} calles el orden de visita se calcula en línea recta.")
+            else:
+                st.caption(f"{len(en_linea_recta)} de {len(result.agents)} agentes tienen más de {MATRIX_MAX_SIZE} calles: "
+                           "su recorrido se ordena y se mide en línea recta.")
     
-    st.subheader("Mapa de asignaciones")
-    mapa_html = mapa_filtrado._repr_html_()
-    st.components.v1.html(mapa_html, width=700, height=500, scrolling=True)
+        st.subheader("Mapa de asignaciones")
+        mapa_html = render_map_html(result, mode, agentes_filtrados, on_error=st.error)
+        st.components.v1.html(mapa_html, width=700, height=500, scrolling=True)
     
-    if not st.session_state.resultado["dataframe"].empty:
-        st.subheader("Datos asignados")
-        st.dataframe(st.session_state.resultado["dataframe"])
+        df = get_assignment_table(result, st.session_state.resultado["territorio"])
+        if not df.empty:
+            st.subheader("Datos asignados")
+            st.dataframe(df)
+        
+            with st.expander("Calendario de trabajo"):
+                incluir_calendario = st.checkbox("Incluir calendario en la descarga", value=False)
+                fecha_inicio = st.date_input("Fecha de inicio:")
+                reparto_label = st.selectbox("Repartir las calles de cada día por:", options=list(SCHEDULE_SPLITS.keys()))
+                reparto, carga_label, carga_defecto = SCHEDULE_SPLITS[reparto_label]
+                carga_por_dia = st.number_input(carga_label, min_value=0.1, value=carga_defecto, step=1.0)
+                dias = st.multiselect("Días laborables:", options=list(WEEKDAYS.keys()), default=list(WEEKDAYS.keys())[:5])
+                feriados_texto = st.text_area("Feriados (AAAA-MM-DD, uno por línea):", value="")
+                try:
+                    feriados = parse_holidays(feriados_texto)
+                except ValueError as e:
+                    st.error(str(e))
+                    feriados = []
+                if incluir_calendario and not dias:
+                    st.warning("Seleccione al menos un día laborable para generar el calendario.")
+        
+            formato_label = st.selectbox("Formato de descarga:", options=list(EXPORT_FORMATS.keys()))
+            formato = EXPORT_FORMATS[formato_label]
+            extension, mime = FORMATS[formato]
         
-        output = BytesIO()
-        st.session_state.resultado["dataframe"].to_excel(output, index=False, engine='openpyxl')
-        output.seek(0)
-        st.download_button(
-            label="Descargar Excel",
-            data=output,
-            file_name="asignacion_calles.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-        )
+            def preparar_descarga():
+                # Se ejecuta sólo al pulsar el botón; los reruns no vuelven a generar el archivo
+                schedule = None
+                if incluir_calendario and dias:
+                    schedule = generate_schedule(df, dias, fecha_inicio, carga_por_dia, split=reparto, holidays=feriados)
+                return export_bytes(df, formato, schedule=schedule)
+        
+            st.download_button(
+                label=f"Descargar {formato_label}",
+                data=preparar_descarga,
+                file_name=f"asignacion_calles.{extension}",
+                mime=mime
+            )
+        else:
+            st.warning("No se encontraron datos de calles para exportar.")
     else:
-        st.warning("No se encontraron datos de calles para exportar.")
-else:
-    st.info("Realice la solicitud de asignación para ver resultados.")
+        st.info("Realice la solicitud de asignación para ver resultados.")
+finally:
+    # El informe se cierra aunque algo falle antes del final de la página: si no, tracemalloc y el
+    # perfilador seguirían activos y el informe se perdería
+    if run_report is not None:
+        st.session_state.diagnostico = run_report.finish().to_dict()
+
+if mostrar_diagnostico and st.session_state.get("diagnostico"):
+    show_diagnostics(st.session_state.diagnostico)
+
+with st.sidebar.expander("Caché compartida"):
+    cache_stats = shared_cache().stats()
+    st.caption(
+        f"{cache_stats['entradas']} objetos · {cache_stats['bytes'] / 2**20:.1f} de {cache_stats['max_bytes'] / 2**20:.0f} MB · "
+        f"aciertos {cache_stats['aciertos']} / fallos {cache_stats['fallos']} ({cache_stats['tasa_aciertos']:.0%}) · "
+        f"expulsiones {cache_stats['expulsiones']}"
+    )
 
 st.markdown(
     """
@@ -0,0 +1 @@
+# Pruebas de rendimiento sin conexión: python -m benchmarks.run
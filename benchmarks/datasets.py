@@ -0,0 +1,112 @@
+import argparse
+import gzip
+import json
+import os
+
+import numpy as np
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+# Origen y separación de la cuadrícula sintética (~100 m entre intersecciones, en Santo Domingo)
+GRID_ORIGIN = (18.45, -69.95)
+GRID_SPACING_DEG = 0.0009
+# Cuadras que abarca cada vía de la cuadrícula
+BLOCKS_PER_WAY = 4
+
+
+# -------------------------------
+# Cuadrícula sintética de calles con la forma de una respuesta de Overpass (out geom)
+# Las intersecciones son nodos compartidos entre vías, con un pequeño desplazamiento
+# aleatorio; cada calle recta se parte en vías de BLOCKS_PER_WAY cuadras.
+# -------------------------------
+def grid_elements(n_ways, seed=0):
+    rng = np.random.default_rng(seed)
+    # Una cuadrícula de m x m cuadras tiene unas 2 * m * m / BLOCKS_PER_WAY vías
+    m = max(BLOCKS_PER_WAY, int(round(np.sqrt(n_ways * BLOCKS_PER_WAY / 2))))
+    jitter = rng.normal(0, GRID_SPACING_DEG * 0.1, size=(m + 1, m + 1, 2))
+    rows, cols = np.meshgrid(np.arange(m + 1), np.arange(m + 1), indexing="ij")
+    lat = GRID_ORIGIN[0] + rows * GRID_SPACING_DEG + jitter[..., 0]
+    lon = GRID_ORIGIN[1] + cols * GRID_SPACING_DEG + jitter[..., 1]
+    node_id = rows * (m + 1) + cols + 1
+
+    elements = []
+    for axis, prefix in ((0, "Calle"), (1, "Avenida")):
+        for line in range(m + 1):
+            for start in range(0, m, BLOCKS_PER_WAY):
+                span = slice(start, min(start + BLOCKS_PER_WAY, m) + 1)
+                if axis == 0:
+                    nodes, lats, lons = node_id[line, span], lat[line, span], lon[line, span]
+                else:
+                    nodes, lats, lons = node_id[span, line], lat[span, line], lon[span, line]
+                elements.append({
+                    "type": "way",
+                    "id": len(elements) + 1,
+                    "nodes": nodes.tolist(),
+                    "tags": {"highway": "residential", "name": f"{prefix} {line + 1}"},
+                    "geometry": [{"lat": float(a), "lon": float(b)} for a, b in zip(lats, lons)],
+                })
+    rng.shuffle(elements)
+    return elements[:n_ways]
+
+
+def elements_boundary(elements):
+    # Rectángulo que contiene todas las vías, como GeoJSON en lon/lat
+    lats = [pt["lat"] for element in elements for pt in element["geometry"]]
+    lons = [pt["lon"] for element in elements for pt in element["geometry"]]
+    s, w, n, e = min(lats), min(lons), max(lats), max(lons)
+    return {"type": "Polygon", "coordinates": [[[w, s], [e, s], [e, n], [w, n], [w, s]]]}
+
+
+# -------------------------------
+# Respuestas de Overpass grabadas de territorios reales (benchmarks/data/<nombre>.json.gz)
+# -------------------------------
+def recorded_path(name):
+    return os.path.join(DATA_DIR, f"{name}.json.gz")
+
+
+def list_recorded():
+    if not os.path.isdir(DATA_DIR):
+        return []
+    return sorted(f[:-len(".json.gz")] for f in os.listdir(DATA_DIR) if f.endswith(".json.gz"))
+
+
+def load_recorded(name):
+    with gzip.open(recorded_path(name), "rt", encoding="utf-8") as f:
+        data = json.load(f)
+    return data["elements"], data.get("boundary")
+
+
+def record(name, territory):
+    # Descarga (una sola vez, con red) las calles de un territorio y las guarda para las pruebas sin conexión
+    from geo_agent.pipeline import get_boundary, get_streets_by_polygon
+
+    boundary = get_boundary(*territory)
+    if not boundary:
+        raise SystemExit(f"No se encontró el perímetro de {territory}")
+    elements = get_streets_by_polygon(boundary) or []
+    os.makedirs(DATA_DIR, exist_ok=True)
+    with gzip.open(recorded_path(name), "wt", encoding="utf-8") as f:
+        json.dump({"territorio": territory, "boundary": boundary, "elements": elements}, f, ensure_ascii=False)
+    return len(elements)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Graba respuestas de Overpass para las pruebas de rendimiento.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    rec = sub.add_parser("record", help="Graba las calles de un territorio")
+    rec.add_argument("name")
+    for key in ("provincia", "municipio", "distrito", "seccion", "barrio"):
+        rec.add_argument(f"--{key}")
+    sub.add_parser("list", help="Lista los territorios grabados")
+    args = parser.parse_args(argv)
+
+    if args.command == "record":
+        territory = (args.provincia, args.municipio, args.distrito, args.seccion, args.barrio)
+        print(f"{record(args.name, territory)} calles -> {recorded_path(args.name)}")
+    else:
+        for name in list_recorded():
+            print(name)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import sklearn
+
+from benchmarks.datasets import elements_boundary, grid_elements, list_recorded, load_recorded
+from geo_agent.assignment import build_assignment, generate_agent_colors
+from geo_agent.clustering import cluster_streets
+from geo_agent.export import export_bytes, generate_dataframe
+from geo_agent.ordering import order_cluster
+from geo_agent.pipeline import replan_streets
+from geo_agent.rendering import build_map
+from geo_agent.schedule import generate_schedule
+from geo_agent.routing import RoadGraph, discard_graph
+from geo_agent.streets import StreetSet
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+# Línea base local, con tiempos y memoria de la máquina en que se graba (no se versiona)
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "baseline.json")
+# Línea base versionada sólo con métricas de calidad de las cuadrículas sintéticas, que no dependen de la máquina
+QUALITY_BASELINE = os.path.join(BENCH_DIR, "baseline_calidad.json")
+QUALITY_METRICS = ["recorrido_km_total", "desbalance_km", "desbalance_recorrido"]
+DEFAULT_SIZES = [100, 1000, 10_000, 100_000]
+QUICK_SIZES = [100, 1000, 10_000]
+STAGES = ["calles", "agrupacion", "ordenamiento", "mapa", "tabla", "exportacion"]
+CLUSTERING_BACKENDS = ["kmeans", "minibatch", "balanced"]
+ROUTE_TIME_BUDGET = 0.5
+
+# Límites para no eternizar los casos más pesados (el mapa completo y el Excel crecen mucho con el tamaño)
+FULL_MAP_MAX_WAYS = 10_000
+XLSX_MAX_WAYS = 20_000
+
+# Umbrales de regresión frente a la línea base
+TIME_TOLERANCE = 1.5         # tiempo (p50) más de 1.5 veces el de la línea base
+TIME_NOISE_FLOOR = 0.005     # diferencias menores de 5 ms no cuentan
+MEMORY_TOLERANCE = 1.25
+TOUR_TOLERANCE = 1.02        # recorrido total un 2 % más largo
+IMBALANCE_TOLERANCE = 0.05   # desbalance (máx/medio) que aumenta más de 0.05
+
+
+def agents_for(n):
+    return int(min(50, max(2, n // 2000)))
+
+
+# -------------------------------
+# Medición
+# -------------------------------
+def measure(fn, repeat, n_items):
+    # Tiempos de `repeat` ejecuciones y pico de memoria de una ejecución aparte con tracemalloc
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        value = fn()
+        times.append(time.perf_counter() - start)
+    gc.collect()
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    times = np.asarray(times)
+    p50 = float(np.percentile(times, 50))
+    return value, {
+        "repeticiones": repeat,
+        "min_s": float(times.min()),
+        "p50_s": p50,
+        "p95_s": float(np.percentile(times, 95)),
+        "calles_por_s": n_items / p50 if p50 > 0 else None,
+        "memoria_pico_mb": peak / 2**20,
+    }
+
+
+def tour_quality(result):
+    km = np.array(list(result.tour_km.values()))
+    mean = km.mean() if len(km) else 0.0
+    return {
+        "recorrido_km_total": float(km.sum()),
+        "desbalance_recorrido": float(km.max() / mean) if mean > 0 else 0.0,
+    }
+
+
+def run_dataset(name, elements, boundary, repeat, stages, progress):
+    cases = {}
+    n = len(elements)
+    num_agents = agents_for(n)
+
+    def add(case, metrics):
+        cases[f"{name}/{case}"] = metrics
+        progress(f"{name}/{case}", metrics)
+
+    street_set, metrics = measure(lambda: StreetSet.from_elements(elements), repeat, n)
+    if "calles" in stages:
+        add("calles", metrics)
+
+    clustering = None
+    for backend in CLUSTERING_BACKENDS:
+        if "agrupacion" not in stages and backend != "kmeans":
+            continue
+        result, metrics = measure(lambda: cluster_streets(street_set, num_agents, backend), repeat, n)
+        metrics.update({"agentes": num_agents, "desbalance_km": result.stats["desbalance"],
+                        "coef_variacion_km": result.stats["coef_variacion"]})
+        if "agrupacion" in stages:
+            add(f"agrupacion-{backend}", metrics)
+        if backend == "kmeans":
+            clustering = result
+
+    colors = generate_agent_colors(num_agents)
+    if "ordenamiento" in stages:
+        # Sólo construcción (vecino más cercano) y con la mejora 2-opt/Or-opt, que está limitada por tiempo:
+        # de esta última interesa sobre todo la calidad del recorrido
+        _, metrics = measure(
+            lambda: [order_cluster(street_set, idx) for idx in clustering.clusters.values()], repeat, n)
+        add("ordenamiento-construccion", metrics)
+        assignment, metrics = measure(
+            lambda: build_assignment(street_set, clustering.clusters, colors, boundary, time_budget=ROUTE_TIME_BUDGET,
+                                     meta={"ordenamiento": "auto"}, clustering=clustering), 1, n)
+        metrics.update(tour_quality(assignment))
+        add("ordenamiento-mejorado", metrics)
+        # Un agente más a partir de la asignación anterior: sólo se divide y se reordena un grupo
+        replanned, metrics = measure(
+            lambda: replan_streets(assignment, num_agents + 1, ROUTE_TIME_BUDGET, engine="auto"), 1, n)
+        metrics.update(tour_quality(replanned))
+        metrics["recorridos_reutilizados"] = replanned.meta["recorridos_reutilizados"]
+        add("reajuste-incremental", metrics)
+        # Por la red de calles: construcción del grafo y ordenamiento con la matriz de distancias de cada grupo
+        _, metrics = measure(lambda: RoadGraph(street_set), repeat, n)
+        add("grafo-calles", metrics)
+
+        def route_by_network():
+            # Sin el grafo ni las matrices de la ejecución anterior
+            discard_graph(street_set)
+            return build_assignment(street_set, clustering.clusters, colors, boundary, time_budget=ROUTE_TIME_BUDGET,
+                                    engine="network")
+
+        routed, metrics = measure(route_by_network, 1, n)
+        metrics.update(tour_quality(routed))
+        add("ordenamiento-red", metrics)
+    else:
+        assignment = build_assignment(street_set, clustering.clusters, colors, boundary, time_budget=ROUTE_TIME_BUDGET)
+
+    if "mapa" in stages:
+        modes = ["Calles (ligero)", "Área"] + (["Calles"] if n <= FULL_MAP_MAX_WAYS else [])
+        for mode in modes:
+            html, metrics = measure(lambda: build_map(assignment, mode)._repr_html_(), repeat, n)
+            metrics["html_mb"] = len(html) / 2**20
+            add(f"mapa-{mode}", metrics)
+
+    df, metrics = measure(lambda: generate_dataframe(assignment, "Provincia", None, None, None, None), repeat, n)
+    if "tabla" in stages:
+        add("tabla", metrics)
+        _, metrics = measure(lambda: generate_schedule(df, ["Lunes", "Martes", "Miércoles", "Jueves", "Viernes"],
+                                                       "2025-01-06", 60, split="minutos"), repeat, n)
+        add("calendario", metrics)
+
+    if "exportacion" in stages:
+        for fmt in ["csv", "parquet"] + (["xlsx"] if n <= XLSX_MAX_WAYS else []):
+            data, metrics = measure(lambda: export_bytes(df, fmt), repeat, n)
+            metrics["archivo_mb"] = len(data) / 2**20
+            add(f"exportacion-{fmt}", metrics)
+    return cases
+
+
+def run_all(sizes, recorded, repeat, stages, progress=lambda case, metrics: None):
+    cases = {}
+    for size in sizes:
+        elements = grid_elements(size)
+        cases.update(run_dataset(f"cuadricula-{size}", elements, elements_boundary(elements), repeat, stages, progress))
+    for name in recorded:
+        elements, boundary = load_recorded(name)
+        cases.update(run_dataset(f"grabado-{name}", elements, boundary, repeat, stages, progress))
+    return {
+        "meta": {
+            "fecha": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "python": sys.version.split()[0],
+            "plataforma": platform.platform(),
+            "procesador": platform.processor() or platform.machine(),
+            "numpy": np.__version__,
+            "sklearn": sklearn.__version__,
+        },
+        "casos": cases,
+    }
+
+
+# -------------------------------
+# Comparación con la línea base
+# -------------------------------
+def compare(current, baseline):
+    regressions = []
+    for case, metrics in current["casos"].items():
+        base = baseline["casos"].get(case)
+        if base is None:
+            continue
+        checks = [
+            ("p50_s", lambda c, b: c > b * TIME_TOLERANCE and c - b > TIME_NOISE_FLOOR),
+            ("memoria_pico_mb", lambda c, b: c > b * MEMORY_TOLERANCE and c - b > 1),
+            ("recorrido_km_total", lambda c, b: c > b * TOUR_TOLERANCE),
+            ("desbalance_km", lambda c, b: c > b + IMBALANCE_TOLERANCE),
+            ("desbalance_recorrido", lambda c, b: c > b + IMBALANCE_TOLERANCE),
+        ]
+        for metric, worse in checks:
+            if metric not in metrics or metric not in base or base[metric] is None:
+                continue
+            c, b = metrics[metric], base[metric]
+            if worse(c, b):
+                regressions.append((case, metric, b, c))
+    return regressions
+
+
+def format_metrics(metrics):
+    parts = [f"p50 {metrics['p50_s'] * 1000:9.1f} ms", f"p95 {metrics['p95_s'] * 1000:9.1f} ms",
+             f"mem {metrics['memoria_pico_mb']:7.1f} MB"]
+    if metrics.get("calles_por_s"):
+        parts.append(f"{metrics['calles_por_s']:12,.0f} calles/s")
+    for key in ("recorrido_km_total", "desbalance_recorrido", "desbalance_km"):
+        if key in metrics:
+            parts.append(f"{key} {metrics[key]:.3f}")
+    return " · ".join(parts)
+
+
+def quality_baseline(results):
+    # Sólo las cuadrículas sintéticas: los territorios grabados no se versionan
+    cases = {}
+    for case, metrics in results["casos"].items():
+        quality = {metric: metrics[metric] for metric in QUALITY_METRICS if metric in metrics}
+        if case.startswith("cuadricula-") and quality:
+            cases[case] = quality
+    return {"meta": results["meta"], "casos": cases}
+
+
+# -------------------------------
+# Línea de comandos
+#   python -m benchmarks.run --quick
+#   python -m benchmarks.run --save-baseline     (en la rama principal)
+#   python -m benchmarks.run                     (en la rama con cambios: compara y falla si hay regresiones)
+#   python -m benchmarks.run --quick --save-quality-baseline   (al cambiar a propósito la calidad de los recorridos)
+# -------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pruebas de rendimiento sin conexión de agrupación, ordenamiento, mapa y exportación.")
+    parser.add_argument("--sizes", type=int, nargs="+", help=f"Vías de las cuadrículas sintéticas (por defecto {DEFAULT_SIZES})")
+    parser.add_argument("--quick", action="store_true", help=f"Sólo {QUICK_SIZES}")
+    parser.add_argument("--recorded", nargs="*", help="Territorios grabados a incluir (por defecto, todos los de benchmarks/data)")
+    parser.add_argument("--stages", nargs="+", default=STAGES, help=f"Etapas a medir: {' '.join(STAGES)}")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--out", help="Guarda los resultados en este JSON")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="Guarda los resultados como nueva línea base")
+    parser.add_argument("--save-quality-baseline", action="store_true",
+                        help=f"Guarda las métricas de calidad de las cuadrículas en {os.path.relpath(QUALITY_BASELINE)}")
+    args = parser.parse_args(argv)
+
+    unknown = set(args.stages) - set(STAGES)
+    if unknown:
+        parser.error(f"etapas desconocidas: {', '.join(sorted(unknown))}")
+    sizes = args.sizes or (QUICK_SIZES if args.quick else DEFAULT_SIZES)
+    recorded = list_recorded() if args.recorded is None else args.recorded
+
+    results = run_all(sizes, recorded, args.repeat, args.stages,
+                      progress=lambda case, metrics: print(f"{case:<45} {format_metrics(metrics)}", flush=True))
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"Línea base guardada en {args.baseline}")
+    if args.save_quality_baseline:
+        with open(QUALITY_BASELINE, "w", encoding="utf-8") as f:
+            json.dump(quality_baseline(results), f, ensure_ascii=False, indent=2)
+        print(f"Línea base de calidad guardada en {QUALITY_BASELINE}")
+    if args.save_baseline or args.save_quality_baseline:
+        return 0
+    baselines = [path for path in (args.baseline, QUALITY_BASELINE) if os.path.exists(path)]
+    if not baselines:
+        print(f"No hay línea base en {args.baseline} ni en {QUALITY_BASELINE}; no se puede comprobar si hay regresiones.",
+              file=sys.stderr)
+        return 2
+    if args.baseline not in baselines:
+        print(f"Aviso: no hay línea base local en {args.baseline} (use --save-baseline en la rama principal); "
+              "sólo se comparan las métricas de calidad, no los tiempos ni la memoria.", file=sys.stderr)
+    regressions = []
+    for path in baselines:
+        with open(path, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions += [r for r in compare(results, baseline) if r not in regressions]
+    if regressions:
+        print(f"\n{len(regressions)} regresiones frente a la línea base:")
+        for case, metric, base, current in regressions:
+            print(f"  {case:<45} {metric:<22} {base:.4g} -> {current:.4g}")
+        return 1
+    print("\nSin regresiones frente a la línea base.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
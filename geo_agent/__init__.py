@@ -0,0 +1,44 @@
+# Paquete con la lógica de Geo Agent reutilizable fuera de la interfaz de Streamlit.
+#
+#   import geo_agent
+#   result = geo_agent.plan_territory(("Santo Domingo", "Santo Domingo Este", None, None, None), num_agents=3)
+#
+# Los nombres públicos se importan al usarlos por primera vez, de modo que `import geo_agent`
+# no carga numpy, pandas, shapely ni scikit-learn.
+import importlib
+
+_EXPORTS = {
+    "get_boundary": "geo_agent.pipeline",
+    "get_street_set": "geo_agent.pipeline",
+    "plan_streets": "geo_agent.pipeline",
+    "replan_streets": "geo_agent.pipeline",
+    "plan_territory": "geo_agent.pipeline",
+    "cached_assignment": "geo_agent.pipeline",
+    "cluster_streets": "geo_agent.clustering",
+    "order_cluster": "geo_agent.ordering",
+    "AssignmentResult": "geo_agent.assignment",
+    "StreetSet": "geo_agent.streets",
+    "generate_dataframe": "geo_agent.export",
+    "export_bytes": "geo_agent.export",
+    "export_file": "geo_agent.export",
+    "assignment_geojson": "geo_agent.export",
+    "generate_schedule": "geo_agent.schedule",
+    "plan": "geo_agent.service",
+    "plan_many": "geo_agent.service",
+    "run_batch": "geo_agent.batch",
+}
+
+__all__ = sorted(_EXPORTS)
+
+
+def __getattr__(name):
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module 'geo_agent' has no attribute {name!r}")
+    value = getattr(importlib.import_module(module), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_EXPORTS))
@@ -0,0 +1,94 @@
+import random
+import time
+import uuid
+from dataclasses import dataclass, field
+
+import numpy as np
+
+from geo_agent.ordering import cluster_engine, distance_kind, order_cluster
+
+
+def generate_agent_colors(num_agents):
+    colors = {}
+    for agent in range(1, num_agents+1):
+        colors[agent-1] = "#" + ''.join([random.choice('0123456789ABCDEF') for _ in range(6)])
+    return colors
+
+
+# -------------------------------
+# Resultado de una asignación: se calcula una vez por ejecución y lo
+# consumen el mapa, la tabla, el calendario y la exportación
+# -------------------------------
+@dataclass
+class AssignmentResult:
+    street_set: object
+    clusters: dict                                # agente -> índices de calles (sin ordenar)
+    orders: dict                                  # agente -> índices de calles en orden de visita
+    tour_km: dict                                 # agente -> longitud del recorrido
+    colors: dict                                  # agente -> color en el mapa
+    boundary: dict = None
+    meta: dict = field(default_factory=dict)
+    # Agrupación de la que sale (ClusteringResult); permite reajustar a otro número de agentes sin empezar de cero
+    clustering: object = None
+    # Identificador único para las cachés que dependen de esta asignación (p. ej. el HTML del mapa)
+    key: str = field(default_factory=lambda: uuid.uuid4().hex)
+
+    @property
+    def agents(self):
+        return list(self.orders.keys())
+
+    def select(self, agents=None):
+        # Agentes a mostrar; None significa todos
+        if agents is None:
+            return self.agents
+        return [agent for agent in agents if agent in self.orders]
+
+
+def build_assignment(street_set, clusters, colors=None, boundary=None, improve=True, time_budget=2.0, meta=None,
+                     engine="auto", previous=None, clustering=None):
+    # previous: asignación anterior del mismo conjunto de calles. Los grupos que conservan exactamente las
+    # mismas calles reutilizan su recorrido si se midió igual (por la red o en línea recta) que ahora.
+    # time_budget: segundos de mejora 2-opt/Or-opt para toda la asignación, no por agente
+    # meta["motores"]: agente -> motor con el que se ordenó su grupo (ver ordering.cluster_engine)
+    reusable = {}
+    if previous is not None and previous.street_set is street_set:
+        reusable = {np.sort(indices).tobytes(): agent for agent, indices in previous.clusters.items() if len(indices)}
+    orders, tour_km, engines = {}, {}, {}
+    reused = 0
+    pending = []
+    for agent, indices in clusters.items():
+        match = reusable.get(np.sort(np.asarray(indices, dtype=np.int64)).tobytes())
+        if match is not None:
+            previous_engine = previous.meta.get("motores", {}).get(match, previous.meta.get("ordenamiento"))
+            if distance_kind(previous_engine) != distance_kind(cluster_engine(engine, len(indices))):
+                match = None
+        if match is not None:
+            orders[agent] = previous.orders[match]
+            tour_km[agent] = previous.tour_km[match]
+            engines[agent] = previous_engine
+            reused += 1
+        else:
+            pending.append((agent, indices))
+    # Cada grupo recibe la parte del tiempo que queda proporcional a sus calles; lo que no usa un grupo pasa a los siguientes
+    deadline = time.perf_counter() + time_budget
+    remaining = sum(len(indices) for _, indices in pending)
+    for agent, indices in pending:
+        share = max(deadline - time.perf_counter(), 0.0) * len(indices) / remaining if remaining else 0.0
+        remaining -= len(indices)
+        route = order_cluster(street_set, indices, engine=engine, improve=improve, time_budget=share)
+        orders[agent] = route.order
+        tour_km[agent] = route.length_km
+        engines[agent] = route.engine
+    meta = dict(meta or {}, motores=engines)
+    if previous is not None:
+        meta["recorridos_reutilizados"] = reused
+    return AssignmentResult(
+        street_set=street_set,
+        clusters={agent: np.asarray(indices, dtype=np.int64) for agent, indices in clusters.items()},
+        orders=orders,
+        tour_km=tour_km,
+        colors=colors if colors is not None else generate_agent_colors(len(clusters)),
+        boundary=boundary,
+        meta=meta,
+        clustering=clustering,
+    )
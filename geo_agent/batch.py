@@ -0,0 +1,238 @@
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import threading
+import unicodedata
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+from geo_agent.boundary_store import BoundaryStore
+from geo_agent.export import FORMATS, export_file, generate_dataframe
+from geo_agent.instrumentation import run
+from geo_agent.pipeline import ROUTE_ENGINE, ROUTE_TIME_BUDGET, get_boundary, get_street_set, open_street_source, plan_streets
+from geo_agent.routing import discard_graph
+from geo_agent.territory import LEVELS, load_territory_index
+
+# Claves aceptadas en el archivo de trabajos para cada nivel territorial
+JOB_KEYS = ["provincia", "municipio", "distrito", "seccion", "barrio"]
+
+MANIFEST = "manifest.jsonl"
+
+
+# -------------------------------
+# Definición de trabajos
+# -------------------------------
+def job_territory(job):
+    return tuple(job.get(key) or None for key in JOB_KEYS)
+
+
+def job_id(job):
+    territory = job_territory(job)
+    text = "-".join(value for value in territory if value)
+    text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii")
+    slug = re.sub(r"[^A-Za-z0-9]+", "_", text).strip("_")[:80] or "territorio"
+    digest = hashlib.sha1(json.dumps([territory, job["agentes"]], ensure_ascii=False).encode("utf-8")).hexdigest()[:8]
+    return f"{slug}_{job['agentes']}a_{digest}"
+
+
+def expand_jobs(specs, index=None):
+    # Un trabajo con "expandir": "Barrio" (o cualquier nivel) se convierte en uno por cada entidad de ese nivel
+    jobs, seen = [], set()
+    for spec in specs:
+        level = spec.get("expandir")
+        if level:
+            index = index or load_territory_index()
+            depth = LEVELS.index(level) + 1
+            for path in index.paths_under(job_territory(spec)):
+                territory = path[:depth]
+                if territory[-1] is None:
+                    continue
+                job = dict(zip(JOB_KEYS, territory), agentes=spec["agentes"])
+                jobs.append(job)
+        else:
+            jobs.append({key: spec.get(key) for key in JOB_KEYS} | {"agentes": spec["agentes"]})
+    unique = []
+    for job in jobs:
+        key = job_id(job)
+        if key not in seen:
+            seen.add(key)
+            unique.append(job)
+    return unique
+
+
+def job_options(fmt, backend, engine):
+    # Opciones que cambian el resultado de un trabajo: un resultado anterior sólo vale si coinciden
+    return {"formato": fmt, "backend": backend, "motor": engine}
+
+
+def read_jobs(path):
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    if path.endswith(".jsonl"):
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+    return json.loads(text)
+
+
+# -------------------------------
+# Etapas: descarga (hilos, concurrencia limitada) y planificación (procesos)
+# -------------------------------
+def plan_job(job, street_set, boundary, out_dir, fmt, backend, time_budget, engine=ROUTE_ENGINE, fetch_report=None):
+    # fetch_report: informe (to_dict) de la descarga, que se une al de la planificación en el resumen
+    key = job_id(job)
+    with run(key) as report:
+        result = plan_streets(street_set, job["agentes"], boundary, backend, time_budget, engine=engine)
+        # Cada territorio se planifica una vez: su grafo no tiene que ocupar la caché del proceso
+        discard_graph(street_set)
+        df = generate_dataframe(result, *job_territory(job))
+        output = export_file(os.path.join(out_dir, f"{key}.{FORMATS[fmt][0]}"), df, fmt)
+    summary = {
+        "id": key,
+        "estado": "ok",
+        "trabajo": job,
+        "opciones": job_options(fmt, backend, engine),
+        "archivo": os.path.basename(output),
+        "calles": len(street_set),
+        "km_recorrido": {str(agent + 1): round(km, 3) for agent, km in result.tour_km.items()},
+        "agrupacion": result.meta.get("clustering"),
+        "segundos_descarga": (fetch_report or {}).get("segundos"),
+        "segundos_plan": report.seconds,
+        "etapas": (fetch_report or {}).get("etapas", []) + report.to_dict()["etapas"],
+    }
+    write_summary(out_dir, summary)
+    return summary
+
+
+def write_summary(out_dir, summary):
+    # El resumen se escribe al final y de forma atómica: marca el trabajo como terminado
+    path = os.path.join(out_dir, f"{summary['id']}.json")
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+def is_done(out_dir, job, options):
+    # Terminado con las mismas opciones y con su archivo todavía en el directorio
+    try:
+        with open(os.path.join(out_dir, f"{job_id(job)}.json"), encoding="utf-8") as f:
+            summary = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return False
+    return (summary.get("estado") == "ok" and summary.get("opciones") == options
+            and bool(summary.get("archivo")) and os.path.exists(os.path.join(out_dir, summary["archivo"])))
+
+
+def run_batch(jobs, out_dir, fmt="xlsx", workers=None, fetch_concurrency=2, backend="auto",
+              time_budget=ROUTE_TIME_BUDGET, resume=True, progress=None, store=None, source=None, engine=ROUTE_ENGINE):
+    os.makedirs(out_dir, exist_ok=True)
+    options = job_options(fmt, backend, engine)
+    pending = [job for job in jobs if not (resume and is_done(out_dir, job, options))]
+    skipped = len(jobs) - len(pending)
+    store = store or BoundaryStore()
+    source = source or open_street_source()
+    boundary_lock = threading.Lock()
+    workers = workers or os.cpu_count() or 1
+    # Límite de trabajos descargados esperando CPU, para no acumular calles en memoria
+    max_queued = workers * 2
+    summaries = []
+    # Los procesos no se crean con fork: los hilos de descarga pueden tener tomados cerrojos
+    # (sesión HTTP, SQLite, informes) que el hijo heredaría bloqueados
+    mp_context = multiprocessing.get_context("forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn")
+
+    def fetch(job):
+        with run(job_id(job)) as report:
+            with boundary_lock:
+                # La primera consulta de cada capa la descarga; se serializa para no bajarla varias veces
+                boundary = get_boundary(*job_territory(job), store=store)
+            street_set = get_street_set(boundary, source) if boundary else None
+        return boundary, street_set, report
+
+    def record(summary):
+        summaries.append(summary)
+        with open(os.path.join(out_dir, MANIFEST), "a", encoding="utf-8") as f:
+            f.write(json.dumps(summary, ensure_ascii=False) + "\n")
+        if progress:
+            progress(summary, len(summaries), len(pending))
+
+    queue = iter(pending)
+    fetching, planning = {}, {}
+    with ThreadPoolExecutor(fetch_concurrency) as io_pool, ProcessPoolExecutor(workers, mp_context=mp_context) as cpu_pool:
+        while True:
+            while len(fetching) < fetch_concurrency and len(planning) < max_queued:
+                job = next(queue, None)
+                if job is None:
+                    break
+                fetching[io_pool.submit(fetch, job)] = job
+            if not fetching and not planning:
+                break
+            done, _ = wait(list(fetching) + list(planning), return_when=FIRST_COMPLETED)
+            for future in done:
+                if future in fetching:
+                    job = fetching.pop(future)
+                    try:
+                        boundary, street_set, report = future.result()
+                    except Exception as e:
+                        record({"id": job_id(job), "estado": "error", "trabajo": job, "error": f"descarga: {e}"})
+                        continue
+                    if street_set is None or not len(street_set):
+                        estado = "sin_limite" if boundary is None else "sin_calles"
+                        record({"id": job_id(job), "estado": estado, "trabajo": job, "segundos_descarga": report.seconds})
+                        continue
+                    planning[cpu_pool.submit(plan_job, job, street_set, boundary, out_dir, fmt, backend, time_budget,
+                                             engine, report.to_dict())] = job
+                else:
+                    job = planning.pop(future)
+                    try:
+                        summary = future.result()
+                    except Exception as e:
+                        summary = {"id": job_id(job), "estado": "error", "trabajo": job, "error": f"planificación: {e}"}
+                    record(summary)
+    return {"total": len(jobs), "omitidos": skipped, "resultados": summaries}
+
+
+# -------------------------------
+# Línea de comandos
+#   python -m geo_agent.batch --jobs plan.json --out salida/
+#   python -m geo_agent.batch --provincia "Santo Domingo" --municipio "Santo Domingo Este" --agentes 3 --out salida/
+# -------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Genera asignaciones para muchos territorios sin la interfaz de Streamlit.")
+    parser.add_argument("--jobs", help="Archivo .json o .jsonl con la lista de territorios y agentes")
+    for key in JOB_KEYS:
+        parser.add_argument(f"--{key}", help=f"Filtro de {key} para generar un trabajo por cada entidad del nivel --expandir")
+    parser.add_argument("--agentes", type=int, default=3)
+    parser.add_argument("--expandir", default="Barrio", choices=LEVELS, help="Nivel al que se expanden los filtros (por defecto, Barrio)")
+    parser.add_argument("--out", required=True, help="Directorio de salida (se reanuda si ya contiene resultados)")
+    parser.add_argument("--format", default="xlsx", choices=sorted(FORMATS))
+    parser.add_argument("--workers", type=int, help="Procesos para clustering y ordenamiento (por defecto, núcleos de CPU)")
+    parser.add_argument("--fetch-concurrency", type=int, default=2, help="Descargas simultáneas de límites y calles")
+    parser.add_argument("--backend", default="auto", help="Método de agrupación: auto, kmeans, minibatch o balanced")
+    parser.add_argument("--engine", default=ROUTE_ENGINE, choices=["network", "auto"],
+                        help="Distancia para ordenar las calles: por la red (network) o en línea recta (auto)")
+    parser.add_argument("--no-resume", action="store_true", help="Recalcula también los territorios ya terminados")
+    args = parser.parse_args(argv)
+
+    if args.jobs:
+        specs = read_jobs(args.jobs)
+    else:
+        filters = {key: getattr(args, key) for key in JOB_KEYS if getattr(args, key)}
+        if not filters:
+            parser.error("indique --jobs o al menos un filtro territorial")
+        specs = [dict(filters, agentes=args.agentes, expandir=args.expandir)]
+    jobs = expand_jobs(specs)
+
+    def progress(summary, done, total):
+        print(f"[{done}/{total}] {summary['estado']:<10} {summary['id']}", flush=True)
+
+    report = run_batch(jobs, args.out, args.format, args.workers, args.fetch_concurrency, args.backend,
+                       resume=not args.no_resume, progress=progress, engine=args.engine)
+    estados = {}
+    for summary in report["resultados"]:
+        estados[summary["estado"]] = estados.get(summary["estado"], 0) + 1
+    print(f"{report['total']} territorios, {report['omitidos']} ya terminados, {estados}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+import argparse
+import json
+import os
+import sqlite3
+import time
+import zlib
+from contextlib import closing
+
+from geo_agent.net import get_json
+from geo_agent.settings import REPO_DIR, cache_path
+
+# -------------------------------
+# Fuentes de cada capa de límites administrativos
+# -------------------------------
+WFS_BASE_URL = "https://geoportal.iderd.gob.do/geoserver/ows?service=WFS&version=1.0.0&request=GetFeature&typename=geonode%3A{typename}&outputFormat=json&srs=EPSG%3A32619&srsName=EPSG%3A32619"
+
+LAYER_SOURCES = {
+    "provincias": os.path.join(REPO_DIR, "provincias.geojson"),
+    "municipios": WFS_BASE_URL.format(typename="RD_MUNICIPIOS"),
+    "distritos": WFS_BASE_URL.format(typename="RD_DM"),
+    "secciones": WFS_BASE_URL.format(typename="RD_SECCIONES"),
+    "barrios": WFS_BASE_URL.format(typename="RD_BPARAJES"),
+}
+
+# Propiedad que contiene el nombre de cada entidad
+LAYER_NAME_FIELDS = {
+    "provincias": "name",
+}
+DEFAULT_NAME_FIELD = "TOPONIMIA"
+
+# Campos de código de las capas del IDERD que identifican a la entidad padre
+PARENT_CODE_FIELDS = ("REG", "PROV", "MUN", "DM", "SECC")
+
+# Sistema de coordenadas de cada capa (el WFS se pide en EPSG:32619)
+LAYER_CRS = {
+    "provincias": "EPSG:4326",
+}
+DEFAULT_CRS = "EPSG:32619"
+
+
+def default_store_path():
+    return os.environ.get("GEO_AGENT_BOUNDARY_STORE") or cache_path("boundaries.sqlite")
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS capas (
+    capa TEXT PRIMARY KEY,
+    origen TEXT,
+    actualizado REAL,
+    total INTEGER
+);
+CREATE TABLE IF NOT EXISTS limites (
+    id INTEGER PRIMARY KEY,
+    capa TEXT NOT NULL,
+    nombre TEXT NOT NULL,
+    clave TEXT NOT NULL,
+    codigo_padre TEXT,
+    propiedades TEXT,
+    geometria BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS limites_clave ON limites (capa, clave, codigo_padre);
+CREATE VIRTUAL TABLE IF NOT EXISTS limites_rtree USING rtree(id, min_x, max_x, min_y, max_y);
+"""
+
+
+def normalize_name(value):
+    # Misma comparación que se hacía sobre TOPONIMIA (strip + upper), colapsando espacios internos
+    return " ".join(str(value).split()).upper()
+
+
+def parent_code(props):
+    parts = [str(props[field]).strip() for field in PARENT_CODE_FIELDS if props.get(field) not in (None, "")]
+    return "-".join(parts) or None
+
+
+def geometry_bounds(geometry):
+    xs, ys = [], []
+
+    def walk(coords):
+        if coords and isinstance(coords[0], (int, float)):
+            xs.append(coords[0])
+            ys.append(coords[1])
+        else:
+            for item in coords:
+                walk(item)
+
+    walk(geometry.get("coordinates", []))
+    if not xs:
+        return None
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def read_source(source):
+    # La fuente puede ser una URL del WFS o una copia local de su salida
+    if source.startswith(("http://", "https://")):
+        return get_json(source)
+    with open(source, encoding="utf-8") as f:
+        return json.load(f)
+
+
+# -------------------------------
+# Almacén local de límites (SQLite + R-tree)
+# -------------------------------
+class BoundaryStore:
+    def __init__(self, path=None):
+        self.path = path or default_store_path()
+        with closing(self._connect()) as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def has_layer(self, layer):
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT 1 FROM capas WHERE capa = ?", (layer,)).fetchone()
+        return row is not None
+
+    def layers(self):
+        with closing(self._connect()) as conn:
+            rows = conn.execute("SELECT capa, origen, actualizado, total FROM capas ORDER BY capa").fetchall()
+        return [{"capa": r[0], "origen": r[1], "actualizado": r[2], "total": r[3]} for r in rows]
+
+    def ingest(self, layer, geojson_data, source="", name_field=None):
+        name_field = name_field or LAYER_NAME_FIELDS.get(layer, DEFAULT_NAME_FIELD)
+        rows = []
+        for feature in geojson_data.get("features", []):
+            props = feature.get("properties") or {}
+            geometry = feature.get("geometry")
+            name = props.get(name_field)
+            if not geometry or not isinstance(name, str) or not name.strip():
+                continue
+            bounds = geometry_bounds(geometry)
+            if bounds is None:
+                continue
+            blob = zlib.compress(json.dumps(geometry, separators=(",", ":")).encode("utf-8"))
+            rows.append((name.strip(), normalize_name(name), parent_code(props), json.dumps(props, ensure_ascii=False), blob, bounds))
+
+        with closing(self._connect()) as conn, conn:
+            # Se reemplaza la capa completa en una sola transacción
+            conn.execute("DELETE FROM limites_rtree WHERE id IN (SELECT id FROM limites WHERE capa = ?)", (layer,))
+            conn.execute("DELETE FROM limites WHERE capa = ?", (layer,))
+            for name, key, code, props, blob, (min_x, min_y, max_x, max_y) in rows:
+                cur = conn.execute(
+                    "INSERT INTO limites (capa, nombre, clave, codigo_padre, propiedades, geometria) VALUES (?, ?, ?, ?, ?, ?)",
+                    (layer, name, key, code, props, blob),
+                )
+                conn.execute(
+                    "INSERT INTO limites_rtree (id, min_x, max_x, min_y, max_y) VALUES (?, ?, ?, ?, ?)",
+                    (cur.lastrowid, min_x, max_x, min_y, max_y),
+                )
+            conn.execute(
+                "INSERT OR REPLACE INTO capas (capa, origen, actualizado, total) VALUES (?, ?, ?, ?)",
+                (layer, source, time.time(), len(rows)),
+            )
+        return len(rows)
+
+    @staticmethod
+    def layer_crs(layer):
+        return LAYER_CRS.get(layer, DEFAULT_CRS)
+
+    def candidates(self, layer, name, parent=None, bbox=None):
+        # Entidades de la capa con ese nombre normalizado. parent: código de la entidad padre (se aceptan
+        # sus descendientes, p. ej. "1-01-01" encaja con "1-01-01-01" pero no con "1-01-010");
+        # bbox: (min_x, min_y, max_x, max_y) en coordenadas de la capa, filtrado con el R-tree
+        query = "SELECT l.nombre, l.codigo_padre, l.geometria FROM limites l"
+        params = []
+        if bbox is not None:
+            query += " JOIN limites_rtree r ON r.id = l.id AND r.max_x >= ? AND r.min_x <= ? AND r.max_y >= ? AND r.min_y <= ?"
+            min_x, min_y, max_x, max_y = bbox
+            params += [min_x, max_x, min_y, max_y]
+        query += " WHERE l.capa = ? AND l.clave = ?"
+        params += [layer, normalize_name(name)]
+        if parent:
+            query += " AND (l.codigo_padre = ? OR l.codigo_padre LIKE ?)"
+            params += [parent, f"{parent}-%"]
+        query += " ORDER BY l.id"
+        with closing(self._connect()) as conn:
+            rows = conn.execute(query, params).fetchall()
+        return [
+            {"nombre": name, "codigo_padre": code, "geometry": json.loads(zlib.decompress(blob))}
+            for name, code, blob in rows
+        ]
+
+    def lookup(self, layer, name, parent=None, bbox=None):
+        found = self.candidates(layer, name, parent, bbox)
+        return found[0]["geometry"] if found else None
+
+    def refresh(self, layer, source=None):
+        source = source or LAYER_SOURCES[layer]
+        return self.ingest(layer, read_source(source), source=source)
+
+
+# -------------------------------
+# Línea de comandos: python -m geo_agent.boundary_store refresh barrios --source RD_BPARAJES.json
+# -------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Gestiona el almacén local de límites administrativos.")
+    parser.add_argument("--store", help="Ruta del archivo SQLite del almacén")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    refresh = sub.add_parser("refresh", help="Carga (o recarga) una o varias capas")
+    refresh.add_argument("layers", nargs="*", help=f"Capas a cargar: {', '.join(sorted(LAYER_SOURCES))} (por defecto, todas)")
+    refresh.add_argument("--source", help="Archivo local o URL con la salida GeoJSON del WFS (sólo con una capa)")
+
+    sub.add_parser("info", help="Muestra las capas almacenadas")
+
+    args = parser.parse_args(argv)
+    store = BoundaryStore(args.store)
+    if args.command == "refresh":
+        layers = args.layers or sorted(LAYER_SOURCES)
+        unknown = [layer for layer in layers if layer not in LAYER_SOURCES]
+        if unknown:
+            parser.error(f"capas desconocidas: {', '.join(unknown)}")
+        if args.source and len(layers) != 1:
+            parser.error("--source requiere indicar exactamente una capa")
+        for layer in layers:
+            total = store.refresh(layer, args.source)
+            print(f"{layer}: {total} entidades")
+    else:
+        for info in store.layers():
+            fecha = time.strftime("%Y-%m-%d %H:%M", time.localtime(info["actualizado"]))
+            print(f"{info['capa']}: {info['total']} entidades ({fecha}) <- {info['origen']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+import time
+from typing import NamedTuple
+
+import numpy as np
+from scipy.spatial.distance import cdist
+
+from geo_agent.geometry import project
+
+# A partir de este número de calles el modo automático usa MiniBatchKMeans
+MINIBATCH_MIN_SIZE = 5000
+
+# Holgura permitida sobre la carga media (km) en el modo balanceado
+BALANCE_TOLERANCE = 0.05
+BALANCE_ITERATIONS = 10
+
+
+class ClusteringResult(NamedTuple):
+    clusters: dict   # agente -> índices de calles
+    labels: np.ndarray
+    centers: np.ndarray   # centros en coordenadas métricas (EPSG:32619)
+    stats: dict
+
+
+# -------------------------------
+# Backends de clustering (todos trabajan en metros, no en grados)
+# scikit-learn se importa al agrupar por primera vez: es lo más lento de cargar del paquete
+# -------------------------------
+def kmeans_labels(points, k, weights=None):
+    from sklearn.cluster import KMeans
+
+    model = KMeans(n_clusters=k, n_init=10, random_state=42).fit(points, sample_weight=weights)
+    return model.labels_, model.cluster_centers_
+
+
+def minibatch_labels(points, k, weights=None):
+    from sklearn.cluster import MiniBatchKMeans
+
+    model = MiniBatchKMeans(n_clusters=k, n_init=3, batch_size=4096, random_state=42).fit(points, sample_weight=weights)
+    return model.labels_, model.cluster_centers_
+
+
+def balanced_labels(points, k, weights, centers=None):
+    # Asignación con capacidad: cada agente recibe como máximo la carga media (+ holgura),
+    # medida en kilómetros de calle. Se parte de los centros indicados (p. ej. de una agrupación
+    # anterior) o, si no hay, de los de (MiniBatch)KMeans ponderado.
+    if centers is None:
+        initial = minibatch_labels if len(points) >= MINIBATCH_MIN_SIZE else kmeans_labels
+        labels, centers = initial(points, k, weights)
+    else:
+        centers = np.array(centers, dtype=np.float64)
+        labels = np.argmin(cdist(points, centers), axis=1)
+    capacity = weights.sum() / k * (1 + BALANCE_TOLERANCE)
+    for _ in range(BALANCE_ITERATIONS):
+        dist = cdist(points, centers)
+        preference = np.argsort(dist, axis=1)
+        sorted_dist = np.take_along_axis(dist, preference, axis=1)
+        # Primero las calles que más pierden si no van a su centro preferido
+        regret = sorted_dist[:, 1] - sorted_dist[:, 0] if k > 1 else sorted_dist[:, 0]
+        load = np.zeros(k)
+        new_labels = np.empty(len(points), dtype=np.int64)
+        for i in np.argsort(-regret):
+            for c in preference[i]:
+                if load[c] + weights[i] <= capacity:
+                    break
+            else:
+                c = int(np.argmin(load))
+            new_labels[i] = c
+            load[c] += weights[i]
+        for c in range(k):
+            members = new_labels == c
+            if members.any():
+                centers[c] = np.average(points[members], axis=0, weights=weights[members])
+        converged = np.array_equal(new_labels, labels)
+        labels = new_labels
+        if converged:
+            break
+    return labels, centers
+
+
+BACKENDS = {
+    "kmeans": kmeans_labels,
+    "minibatch": minibatch_labels,
+    "balanced": balanced_labels,
+}
+
+
+def balance_stats(street_set, clusters):
+    km = np.array([street_set.lengths_km[idx].sum() for idx in clusters.values()])
+    counts = np.array([len(idx) for idx in clusters.values()])
+    mean_km = km.mean() if len(km) else 0.0
+    return {
+        "calles_por_agente": counts.tolist(),
+        "km_por_agente": km.round(3).tolist(),
+        "km_medio": float(mean_km),
+        # Relación entre la carga máxima y la media (1.0 = perfectamente equilibrado)
+        "desbalance": float(km.max() / mean_km) if mean_km > 0 else 0.0,
+        "coef_variacion": float(km.std() / mean_km) if mean_km > 0 else 0.0,
+    }
+
+
+def street_weights(street_set):
+    # Las calles de un solo punto pesan como una calle corta para no quedar "gratis"
+    return np.maximum(street_set.lengths_km, 0.01)
+
+
+def cluster_streets(street_set, num_agents, backend="auto"):
+    start = time.perf_counter()
+    n = len(street_set)
+    if backend == "auto":
+        backend = "minibatch" if n >= MINIBATCH_MIN_SIZE else "kmeans"
+    if n == 0:
+        return ClusteringResult({}, np.empty(0, dtype=np.int64), np.empty((0, 2)), {"backend": backend, "segundos": 0.0})
+    # No puede haber más grupos que calles; los agentes sobrantes quedan sin calles
+    k = min(num_agents, n)
+    points = project(street_set.centroids)
+    weights = street_weights(street_set)
+    if backend == "balanced":
+        labels, centers = balanced_labels(points, k, weights)
+    else:
+        labels, centers = BACKENDS[backend](points, k)
+    clusters = {i: np.flatnonzero(labels == i) for i in range(num_agents)}
+    stats = {"backend": backend, "segundos": time.perf_counter() - start}
+    stats.update(balance_stats(street_set, clusters))
+    return ClusteringResult(clusters, np.asarray(labels, dtype=np.int64), centers, stats)
+
+
+# -------------------------------
+# Reajuste incremental a otro número de agentes
+# Se parte de los grupos y centros de una agrupación anterior del mismo conjunto de calles:
+# para añadir un agente se divide en dos el grupo con más km; para quitarlo, las calles del
+# grupo con menos km pasan al centro más cercano y el último agente ocupa su número.
+# Los demás grupos no cambian, de modo que sus recorridos se pueden reutilizar. En el modo
+# balanceado, después se vuelve a repartir la carga con los centros resultantes como punto de partida.
+# -------------------------------
+def adjust_clusters(street_set, previous, num_agents, backend=None):
+    start = time.perf_counter()
+    backend = backend or previous.stats.get("backend", "kmeans")
+    n = len(street_set)
+    k = len(previous.centers)
+    target = min(num_agents, n)
+    if n == 0 or k == 0:
+        return cluster_streets(street_set, num_agents, backend)
+    points = project(street_set.centroids)
+    weights = street_weights(street_set)
+    labels = previous.labels.copy()
+    centers = np.array(previous.centers, dtype=np.float64)
+
+    while k < target:
+        load = np.bincount(labels, weights=weights, minlength=k)
+        sizes = np.bincount(labels, minlength=k)
+        load[sizes < 2] = -np.inf
+        c = int(np.argmax(load))
+        if not np.isfinite(load[c]):
+            break
+        members = np.flatnonzero(labels == c)
+        sub_labels, sub_centers = kmeans_labels(points[members], 2, weights[members])
+        labels[members[sub_labels == 1]] = k
+        centers[c] = sub_centers[0]
+        centers = np.vstack([centers, sub_centers[1]])
+        k += 1
+
+    while k > target:
+        load = np.bincount(labels, weights=weights, minlength=k)
+        c = int(np.argmin(load))
+        members = np.flatnonzero(labels == c)
+        others = np.delete(np.arange(k), c)
+        labels[members] = others[np.argmin(cdist(points[members], centers[others]), axis=1)]
+        for receiver in np.unique(labels[members]):
+            inside = labels == receiver
+            centers[receiver] = np.average(points[inside], axis=0, weights=weights[inside])
+        last = k - 1
+        if c != last:
+            labels[labels == last] = c
+            centers[c] = centers[last]
+        centers = centers[:last]
+        k -= 1
+
+    if backend == "balanced" and k != len(previous.centers):
+        # El modo balanceado vuelve a repartir la carga partiendo de los centros ya ajustados
+        labels, centers = balanced_labels(points, k, weights, centers)
+        labels = np.asarray(labels, dtype=np.int64)
+
+    clusters = {i: np.flatnonzero(labels == i) for i in range(num_agents)}
+    stats = {"backend": backend, "incremental": True, "segundos": time.perf_counter() - start}
+    stats.update(balance_stats(street_set, clusters))
+    return ClusteringResult(clusters, labels, centers, stats)
@@ -0,0 +1,171 @@
+import io
+import json
+
+import numpy as np
+import pandas as pd
+
+from geo_agent.instrumentation import stage
+
+COUNTRY = "🇩🇴 República Dominicana"
+ADMIN_COLUMNS = ["Provincia", "Municipio", "Distrito Municipal", "Sección", "Barrio", "País"]
+
+# Formato -> (extensión, tipo MIME)
+FORMATS = {
+    "xlsx": ("xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "csv": ("csv", "text/csv"),
+    "parquet": ("parquet", "application/vnd.apache.parquet"),
+}
+
+CSV_CHUNK_ROWS = 50_000
+
+
+def constant_column(value, n):
+    # Columna categórica con un único valor: un código por fila en lugar de repetir el texto
+    if value is None:
+        return pd.Categorical.from_codes(np.full(n, -1, dtype=np.int8), categories=[])
+    return pd.Categorical.from_codes(np.zeros(n, dtype=np.int8), categories=[value])
+
+
+# -------------------------------
+# Tabla de asignación construida a partir de los arreglos columnares
+# -------------------------------
+def generate_dataframe(result, selected_prov, selected_muni, selected_dist, selected_secc, selected_barrio):
+    with stage("tabla") as counts:
+        df = _assignment_frame(result, selected_prov, selected_muni, selected_dist, selected_secc, selected_barrio)
+        counts["filas"] = len(df)
+    return df
+
+
+def _assignment_frame(result, selected_prov, selected_muni, selected_dist, selected_secc, selected_barrio):
+    street_set = result.street_set
+    ordered = [result.orders[agent] for agent in result.agents]
+    idx = np.concatenate(ordered) if ordered else np.empty(0, dtype=np.int64)
+    n = len(idx)
+    agents = np.repeat(np.asarray(result.agents, dtype=np.int64) + 1, [len(order) for order in ordered])
+    positions = np.concatenate([np.arange(1, len(order) + 1) for order in ordered]) if ordered else np.empty(0, dtype=np.int64)
+    admin = dict(zip(ADMIN_COLUMNS, [selected_prov, selected_muni, selected_dist, selected_secc, selected_barrio, COUNTRY]))
+    return pd.DataFrame({
+        "Calle": street_set.names[idx],
+        **{column: constant_column(value, n) for column, value in admin.items()},
+        "Latitud": street_set.centroids[idx, 0],
+        "Longitud": street_set.centroids[idx, 1],
+        "Km": street_set.lengths_km[idx].round(3),
+        "Agente": agents,
+        "Order": positions,
+    })
+
+
+def schedule_table(schedule):
+    # {agente: [{"Date": ..., "Calles": [...]}, ...]} -> una fila por calle y día
+    rows = [
+        (agent, day_number, entry["Date"], position, street)
+        for agent, days in schedule.items()
+        for day_number, entry in enumerate(days, start=1)
+        for position, street in enumerate(entry["Calles"], start=1)
+    ]
+    return pd.DataFrame(rows, columns=["Agente", "Día", "Fecha", "Orden", "Calle"])
+
+
+def with_schedule(df, schedule):
+    # Añade a cada calle de la tabla el día y la fecha del calendario según su orden de visita
+    sched = schedule if isinstance(schedule, pd.DataFrame) else schedule_table(schedule)
+    sched = sched.assign(Order=sched.groupby("Agente").cumcount() + 1)[["Agente", "Order", "Día", "Fecha"]]
+    return df.merge(sched, on=["Agente", "Order"], how="left")
+
+
+# -------------------------------
+# JSON y GeoJSON (servicio HTTP)
+# -------------------------------
+def frame_records(df):
+    # Filas como diccionarios serializables: NaN -> null, fechas en ISO 8601 (sólo el día si no llevan hora)
+    dates = {column: df[column].dt.strftime("%Y-%m-%d") for column in df.columns
+             if pd.api.types.is_datetime64_any_dtype(df[column]) and (df[column].dt.normalize() == df[column]).all()}
+    if dates:
+        df = df.assign(**dates)
+    return json.loads(df.to_json(orient="records", date_format="iso", force_ascii=False))
+
+
+def assignment_geojson(result, df):
+    # FeatureCollection con una vía por fila de la tabla (en orden de visita); las columnas van como propiedades
+    street_set = result.street_set
+    ordered = [result.orders[agent] for agent in result.agents]
+    idx = np.concatenate(ordered) if ordered else np.empty(0, dtype=np.int64)
+    features = []
+    for i, properties in zip(idx, frame_records(df.drop(columns=["Latitud", "Longitud"]))):
+        coords = street_set.coords(i)[:, ::-1].tolist()
+        geometry = {"type": "LineString", "coordinates": coords} if len(coords) > 1 else {"type": "Point", "coordinates": coords[0]}
+        properties["osm_id"] = int(street_set.ids[i])
+        properties["color"] = result.colors.get(properties["Agente"] - 1)
+        features.append({"type": "Feature", "geometry": geometry, "properties": properties})
+    return {"type": "FeatureCollection", "features": features}
+
+
+# -------------------------------
+# Escritores
+# -------------------------------
+def _append_frame(ws, df):
+    ws.append(list(df.columns))
+    # Conversión por columnas a tipos de Python (NaN -> celda vacía) y escritura fila a fila
+    columns = [df[column].astype(object).where(df[column].notna(), None).tolist() for column in df.columns]
+    for row in zip(*columns):
+        ws.append(row)
+
+
+def write_xlsx(out, df, schedule=None, per_agent_sheets=True):
+    # Libro en modo write_only: las filas se escriben en streaming sin mantener las celdas en memoria
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+    _append_frame(wb.create_sheet("Asignación"), df)
+    if per_agent_sheets:
+        for agent, agent_df in df.groupby("Agente", sort=True, observed=True):
+            _append_frame(wb.create_sheet(f"Agente {agent}"), agent_df)
+    if schedule is not None:
+        _append_frame(wb.create_sheet("Calendario"), schedule if isinstance(schedule, pd.DataFrame) else schedule_table(schedule))
+    wb.save(out)
+
+
+def write_csv(out, df, schedule=None):
+    # Un CSV es una sola tabla: el calendario, si se pide, se une como columnas Día y Fecha de cada calle
+    if schedule is not None:
+        df = with_schedule(df, schedule)
+    text = io.TextIOWrapper(out, encoding="utf-8-sig", newline="")
+    df.to_csv(text, index=False, chunksize=CSV_CHUNK_ROWS)
+    text.flush()
+    text.detach()
+
+
+def write_parquet(out, df, schedule=None):
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError as e:
+        raise ImportError("Para exportar a Parquet hace falta instalar 'pyarrow' (pip install pyarrow)") from e
+    if schedule is not None:
+        # Parquet guarda una sola tabla, como el CSV
+        df = with_schedule(df, schedule)
+    df.to_parquet(out, index=False)
+
+
+WRITERS = {
+    "xlsx": write_xlsx,
+    "csv": write_csv,
+    "parquet": write_parquet,
+}
+
+
+def export_bytes(df, fmt="xlsx", schedule=None):
+    with stage(f"exportacion_{fmt}", filas=len(df)) as counts:
+        out = io.BytesIO()
+        WRITERS[fmt](out, df, schedule=schedule)
+        data = out.getvalue()
+        counts["bytes"] = len(data)
+    return data
+
+
+def export_file(path, df, fmt=None, schedule=None):
+    fmt = fmt or path.rsplit(".", 1)[-1].lower()
+    with stage(f"exportacion_{fmt}", filas=len(df)) as counts:
+        with open(path, "wb") as out:
+            WRITERS[fmt](out, df, schedule=schedule)
+            counts["bytes"] = out.tell()
+    return path
@@ -0,0 +1,73 @@
+from functools import lru_cache
+
+import numpy as np
+import shapely
+import shapely.geometry
+from pyproj import Transformer
+
+# Sistema de coordenadas métrico usado para clustering y distancias (UTM 19N)
+METRIC_CRS = "EPSG:32619"
+
+
+@lru_cache(maxsize=None)
+def get_transformer(src="EPSG:4326", dst=METRIC_CRS):
+    return Transformer.from_crs(src, dst, always_xy=True)
+
+
+def project(latlon):
+    # Proyecta (lat, lon) a metros en UTM 19N con una sola llamada vectorizada
+    latlon = np.asarray(latlon, dtype=np.float64).reshape(-1, 2)
+    x, y = get_transformer().transform(latlon[:, 1], latlon[:, 0])
+    return np.column_stack([x, y])
+
+
+def first_coordinate(geometry):
+    coords = geometry["coordinates"]
+    while isinstance(coords[0], (list, tuple)):
+        coords = coords[0]
+    return coords
+
+
+def is_lonlat(geometry):
+    # Si el primer punto tiene latitud entre -90 y 90 (y longitud válida), asumimos EPSG:4326;
+    # en otro caso las coordenadas vienen en EPSG:32619 como las capas del IDERD
+    lon, lat = first_coordinate(geometry)[:2]
+    return -90 <= lat <= 90 and -180 <= lon <= 180
+
+
+def boundary_shape(geometry):
+    # Geometría shapely del límite en lon/lat, reproyectando todo el arreglo de una vez si hace falta
+    geom = shapely.geometry.shape(geometry)
+    if not is_lonlat(geometry):
+        transformer = get_transformer(METRIC_CRS, "EPSG:4326")
+        geom = shapely.transform(geom, lambda xy: np.column_stack(transformer.transform(xy[:, 0], xy[:, 1])))
+    return shapely.make_valid(geom) if not geom.is_valid else geom
+
+
+def bounds_in(geometry, crs):
+    # Rectángulo envolvente de un límite en el sistema de coordenadas indicado
+    shape = boundary_shape(geometry)
+    if crs != "EPSG:4326":
+        transformer = get_transformer("EPSG:4326", crs)
+        shape = shapely.transform(shape, lambda xy: np.column_stack(transformer.transform(xy[:, 0], xy[:, 1])))
+    return shape.bounds
+
+
+def way_geometries(coords, owner, counts):
+    # Una geometría shapely por vía a partir de sus puntos (lon, lat) consecutivos: línea si tiene 2+ puntos,
+    # punto si tiene uno. owner: vía de cada punto; counts: puntos de cada vía
+    geoms = np.empty(len(counts), dtype=object)
+    is_line = counts > 1
+    line_points = is_line[owner]
+    if is_line.any():
+        # linestrings() necesita índices consecutivos: se renumeran sólo las vías con 2+ puntos
+        line_index = np.cumsum(is_line) - 1
+        geoms[is_line] = shapely.linestrings(coords[line_points], indices=line_index[owner[line_points]])
+    if (~is_line).any():
+        geoms[~is_line] = shapely.points(coords[~line_points])
+    return geoms
+
+
+def street_geometries(street_set):
+    coords = np.column_stack([street_set.lon, street_set.lat])
+    return way_geometries(coords, street_set.point_way, np.diff(street_set.offsets))
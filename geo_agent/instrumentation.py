@@ -0,0 +1,205 @@
+import contextvars
+import cProfile
+import io
+import json
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+PROFILE_TOP = 40
+
+_current = contextvars.ContextVar("geo_agent_run", default=None)
+
+
+def max_rss_bytes():
+    if resource is None:
+        return None
+    # ru_maxrss está en KiB en Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+# -------------------------------
+# Informe de una ejecución: etapas con tiempo, contadores y memoria
+# -------------------------------
+class RunReport:
+    def __init__(self, name, profile=False, trace_memory=False):
+        self.name = name
+        self.profile = profile
+        self.trace_memory = trace_memory
+        self.stages = []
+        self.counters = {}
+        self.profile_text = None
+        self.seconds = None
+        self.memory_peak = None
+        self._open = []
+        self._peaks = []
+        self._lock = threading.Lock()
+        self._profiler = None
+        self._started_tracing = False
+        self._token = None
+
+    def start(self):
+        self._token = _current.set(self)
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        if self.profile:
+            self._profiler = cProfile.Profile()
+            try:
+                self._profiler.enable()
+            except ValueError:
+                # Ya hay otro perfilador activo en este hilo
+                self._profiler = None
+        self._start = time.perf_counter()
+        return self
+
+    def finish(self):
+        self.seconds = time.perf_counter() - self._start
+        if self._profiler is not None:
+            self._profiler.disable()
+            out = io.StringIO()
+            pstats.Stats(self._profiler, stream=out).sort_stats("cumulative").print_stats(PROFILE_TOP)
+            self.profile_text = out.getvalue()
+            self._profiler = None
+        if tracemalloc.is_tracing() and self.trace_memory:
+            self.memory_peak = max([tracemalloc.get_traced_memory()[1]] + self._peaks
+                                   + [stage.get("memoria_pico", 0) for stage in self.stages])
+            if self._started_tracing:
+                tracemalloc.stop()
+        if self._token is not None:
+            _current.reset(self._token)
+            self._token = None
+        return self
+
+    @contextmanager
+    def stage(self, name, **counts):
+        record = {"etapa": name, "segundos": 0.0, "contadores": dict(counts)}
+        tracing = self.trace_memory and tracemalloc.is_tracing()
+        with self._lock:
+            if tracing:
+                # El pico acumulado hasta aquí pertenece a las etapas abiertas y a la ejecución
+                peak = tracemalloc.get_traced_memory()[1]
+                self._peaks.append(peak)
+                for parent in self._open:
+                    parent.setdefault("_pico_hijos", []).append(peak)
+                tracemalloc.reset_peak()
+            record["nivel"] = len(self._open)
+            self.stages.append(record)
+            self._open.append(record)
+        start = time.perf_counter()
+        try:
+            yield record["contadores"]
+        finally:
+            record["segundos"] = time.perf_counter() - start
+            if tracing:
+                record["memoria_pico"] = max([tracemalloc.get_traced_memory()[1]] + record.pop("_pico_hijos", []))
+            with self._lock:
+                self._open.remove(record)
+                if tracing:
+                    for parent in self._open:
+                        parent.setdefault("_pico_hijos", []).append(record["memoria_pico"])
+
+    def count(self, counter, value=1):
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + value
+            if self._open:
+                counts = self._open[-1]["contadores"]
+                counts[counter] = counts.get(counter, 0) + value
+
+    def to_dict(self):
+        return {
+            "ejecucion": self.name,
+            "segundos": self.seconds,
+            "memoria_pico": self.memory_peak,
+            "rss_max": max_rss_bytes(),
+            "contadores": dict(self.counters),
+            "etapas": [dict(stage) for stage in self.stages],
+            "perfil": self.profile_text,
+        }
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), ensure_ascii=False, indent=2)
+
+    def to_openmetrics(self):
+        return report_openmetrics(self.to_dict())
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+
+def report_openmetrics(report):
+    # Formato de exposición OpenMetrics (texto) a partir de un informe ya serializado con to_dict()
+    run = _label(report["ejecucion"])
+    lines = [
+        "# TYPE geo_agent_run_seconds gauge",
+        f'geo_agent_run_seconds{{run="{run}"}} {report["segundos"] or 0.0}',
+    ]
+    if report.get("memoria_pico") is not None:
+        lines += ["# TYPE geo_agent_run_memory_peak_bytes gauge", "# UNIT geo_agent_run_memory_peak_bytes bytes",
+                  f'geo_agent_run_memory_peak_bytes{{run="{run}"}} {report["memoria_pico"]}']
+    lines.append("# TYPE geo_agent_run_counter gauge")
+    lines += [f'geo_agent_run_counter{{run="{run}",counter="{_label(name)}"}} {value}'
+              for name, value in report["contadores"].items()]
+    lines.append("# TYPE geo_agent_stage_seconds gauge")
+    for position, stage in enumerate(report["etapas"]):
+        labels = f'run="{run}",stage="{_label(stage["etapa"])}",position="{position}"'
+        lines.append(f"geo_agent_stage_seconds{{{labels}}} {stage['segundos']}")
+    lines.append("# TYPE geo_agent_stage_counter gauge")
+    for position, stage in enumerate(report["etapas"]):
+        labels = f'run="{run}",stage="{_label(stage["etapa"])}",position="{position}"'
+        lines += [f'geo_agent_stage_counter{{{labels},counter="{_label(name)}"}} {value}'
+                  for name, value in stage["contadores"].items()]
+    if any("memoria_pico" in stage for stage in report["etapas"]):
+        lines += ["# TYPE geo_agent_stage_memory_peak_bytes gauge", "# UNIT geo_agent_stage_memory_peak_bytes bytes"]
+        for position, stage in enumerate(report["etapas"]):
+            if "memoria_pico" in stage:
+                labels = f'run="{run}",stage="{_label(stage["etapa"])}",position="{position}"'
+                lines.append(f"geo_agent_stage_memory_peak_bytes{{{labels}}} {stage['memoria_pico']}")
+    lines.append("# EOF")
+    return "\n".join(lines) + "\n"
+
+
+# -------------------------------
+# API para el resto de módulos: sin una ejecución activa, stage() y count() no hacen nada
+# -------------------------------
+def current_run():
+    return _current.get()
+
+
+def start_run(name, profile=False, trace_memory=False):
+    return RunReport(name, profile, trace_memory).start()
+
+
+@contextmanager
+def run(name, profile=False, trace_memory=False):
+    report = start_run(name, profile, trace_memory)
+    try:
+        yield report
+    finally:
+        report.finish()
+
+
+@contextmanager
+def stage(name, **counts):
+    report = _current.get()
+    if report is None:
+        yield dict(counts)
+        return
+    with report.stage(name, **counts) as record:
+        yield record
+
+
+def count(counter, value=1):
+    report = _current.get()
+    if report is not None:
+        report.count(counter, value)
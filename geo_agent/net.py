@@ -0,0 +1,155 @@
+import asyncio
+import contextvars
+import hashlib
+import json
+import random
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from geo_agent.instrumentation import count
+
+# (conexión, lectura) en segundos
+DEFAULT_TIMEOUT = (10, 120)
+# Respuestas que indican saturación o un fallo pasajero del servidor (Overpass usa 429 y 504)
+RETRY_STATUS = {429, 502, 503, 504}
+MAX_RETRIES = 4
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+POOL_SIZE = 16
+USER_AGENT = "geo-agent (+https://github.com/DataPicasso/geo-agent)"
+
+_session = None
+_session_lock = threading.Lock()
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+class HttpError(Exception):
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+# -------------------------------
+# Sesión compartida con conexiones persistentes
+# -------------------------------
+def get_session():
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.headers["User-Agent"] = USER_AGENT
+            _session = session
+        return _session
+
+
+def backoff_delay(attempt, response=None):
+    # Retry-After del servidor si lo indica; si no, espera exponencial con variación aleatoria
+    if response is not None:
+        retry_after = response.headers.get("Retry-After", "")
+        if retry_after.isdigit():
+            return min(float(retry_after), BACKOFF_MAX)
+    return min(BACKOFF_BASE * 2 ** attempt, BACKOFF_MAX) * (0.5 + random.random() / 2)
+
+
+def _send(method, url, params, data, timeout, retries):
+    session = get_session()
+    for attempt in range(retries + 1):
+        try:
+            response = session.request(method, url, params=params, data=data, timeout=timeout)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if attempt == retries:
+                raise HttpError(f"{method} {url}: {e}") from e
+            count("reintentos")
+            time.sleep(backoff_delay(attempt))
+            continue
+        if response.status_code in RETRY_STATUS and attempt < retries:
+            count("reintentos")
+            time.sleep(backoff_delay(attempt, response))
+            continue
+        if response.status_code >= 400:
+            raise HttpError(f"{method} {url}: HTTP {response.status_code}", response.status_code)
+        count("peticiones")
+        count("bytes_descargados", len(response.content))
+        return response.content
+    raise HttpError(f"{method} {url}: sin respuesta")
+
+
+def request_key(method, url, params=None, data=None):
+    payload = json.dumps([method, url, params, data], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+# -------------------------------
+# Peticiones síncronas
+# Peticiones idénticas en curso (de distintos hilos o sesiones de Streamlit) se agrupan:
+# sólo la primera llega al servidor y las demás esperan su resultado.
+# -------------------------------
+def fetch_bytes(method, url, params=None, data=None, timeout=DEFAULT_TIMEOUT, retries=MAX_RETRIES, coalesce=True):
+    if not coalesce:
+        return _send(method, url, params, data, timeout, retries)
+    key = request_key(method, url, params, data)
+    with _inflight_lock:
+        future = _inflight.get(key)
+        owner = future is None
+        if owner:
+            future = _inflight[key] = Future()
+    if not owner:
+        return future.result()
+    try:
+        future.set_result(_send(method, url, params, data, timeout, retries))
+    except BaseException as e:
+        future.set_exception(e)
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+    return future.result()
+
+
+def get_json(url, params=None, **kwargs):
+    return json.loads(fetch_bytes("GET", url, params=params, **kwargs))
+
+
+def post_json(url, data=None, **kwargs):
+    return json.loads(fetch_bytes("POST", url, data=data, **kwargs))
+
+
+# -------------------------------
+# Variantes asyncio: se ejecutan sobre la misma sesión en hilos, de modo que
+# comparten conexiones y agrupación de peticiones con el código síncrono
+# -------------------------------
+async def get_json_async(url, params=None, **kwargs):
+    return await asyncio.to_thread(get_json, url, params, **kwargs)
+
+
+async def post_json_async(url, data=None, **kwargs):
+    return await asyncio.to_thread(post_json, url, data, **kwargs)
+
+
+async def gather_limited(calls, concurrency=4):
+    # calls: funciones sin argumentos que devuelven corrutinas; el resultado conserva el orden
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(call):
+        async with semaphore:
+            return await call()
+
+    return await asyncio.gather(*(run(call) for call in calls))
+
+
+def run_concurrently(functions, concurrency=4):
+    # Ejecuta funciones síncronas en paralelo (p. ej. descargas) desde código que no es asíncrono
+    functions = list(functions)
+    if len(functions) <= 1 or concurrency <= 1:
+        return [function() for function in functions]
+    # Cada hilo recibe una copia del contexto, para que la instrumentación siga registrando sus descargas
+    contexts = [contextvars.copy_context() for _ in functions]
+    with ThreadPoolExecutor(min(concurrency, len(functions))) as pool:
+        return list(pool.map(lambda context, function: context.run(function), contexts, functions))
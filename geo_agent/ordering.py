@@ -0,0 +1,231 @@
+import time
+from typing import NamedTuple
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from geo_agent.geometry import project
+from geo_agent.routing import MATRIX_MAX_SIZE, road_graph
+from geo_agent.streets import haversine_km
+
+# Por debajo de este tamaño la búsqueda vectorizada por haversine es más rápida que construir el árbol
+KDTREE_MIN_SIZE = 256
+
+
+class RouteOrder(NamedTuple):
+    order: np.ndarray   # Índices del conjunto de calles en el orden de visita
+    length_km: float    # Longitud del recorrido entre centroides consecutivos
+    engine: str
+
+
+def path_length_km(latlon, order):
+    if len(order) < 2:
+        return 0.0
+    pts = latlon[order]
+    return float(haversine_km(pts[:-1, 0], pts[:-1, 1], pts[1:, 0], pts[1:, 1]).sum())
+
+
+# -------------------------------
+# Motores de vecino más cercano
+# -------------------------------
+def nearest_neighbour_haversine(latlon, start=0):
+    n = len(latlon)
+    visited = np.zeros(n, dtype=bool)
+    order = np.empty(n, dtype=np.int64)
+    current = start
+    for step in range(n):
+        order[step] = current
+        visited[current] = True
+        if step == n - 1:
+            break
+        dist = haversine_km(latlon[current, 0], latlon[current, 1], latlon[:, 0], latlon[:, 1])
+        dist[visited] = np.inf
+        current = int(np.argmin(dist))
+    return order
+
+
+def nearest_neighbour_kdtree(latlon, start=0):
+    points = project(latlon)
+    n = len(points)
+    visited = np.zeros(n, dtype=bool)
+    order = np.empty(n, dtype=np.int64)
+    # El árbol se reconstruye sólo con los puntos pendientes cuando la mitad de los indexados ya se visitó
+    alive = np.arange(n)
+    tree = cKDTree(points)
+    visited_since_build = 0
+    current = start
+    for step in range(n):
+        order[step] = current
+        visited[current] = True
+        visited_since_build += 1
+        if step == n - 1:
+            break
+        if visited_since_build * 2 > len(alive):
+            alive = np.flatnonzero(~visited)
+            tree = cKDTree(points[alive])
+            visited_since_build = 0
+        k = 8
+        while True:
+            k = min(k, len(alive))
+            _, found = tree.query(points[current], k=k)
+            candidates = alive[np.atleast_1d(found)]
+            free = candidates[~visited[candidates]]
+            if len(free):
+                current = int(free[0])
+                break
+            k *= 4
+    return order
+
+
+def nearest_neighbour_matrix(matrix, start=0):
+    # Igual que los anteriores, pero con una matriz de distancias ya calculada (p. ej. por la red de calles)
+    n = len(matrix)
+    visited = np.zeros(n, dtype=bool)
+    order = np.empty(n, dtype=np.int64)
+    current = start
+    for step in range(n):
+        order[step] = current
+        visited[current] = True
+        if step == n - 1:
+            break
+        dist = np.where(visited, np.inf, matrix[current])
+        current = int(np.argmin(dist))
+    return order
+
+
+ENGINES = {
+    "haversine": nearest_neighbour_haversine,
+    "kdtree": nearest_neighbour_kdtree,
+}
+
+
+def register_engine(name, func):
+    # func(latlon, start) -> arreglo con el orden de visita (posiciones dentro de latlon)
+    ENGINES[name] = func
+
+
+# -------------------------------
+# Mejora local (2-opt y Or-opt) sobre un recorrido abierto con el primer punto fijo
+# dist(i, j) devuelve la distancia entre posiciones (escalares o arreglos que se difunden):
+# euclídea sobre puntos proyectados o leída de una matriz de distancias por la red.
+# -------------------------------
+def euclidean(points):
+    x, y = np.ascontiguousarray(points[:, 0]), np.ascontiguousarray(points[:, 1])
+    return lambda i, j: np.hypot(x[i] - x[j], y[i] - y[j])
+
+
+def from_matrix(matrix):
+    return lambda i, j: matrix[i, j]
+
+
+def two_opt(dist, order, deadline):
+    order = np.array(order, dtype=np.int64)
+    n = len(order)
+    improved = True
+    while improved and time.perf_counter() < deadline:
+        improved = False
+        for i in range(n - 2):
+            if time.perf_counter() >= deadline:
+                break
+            # Invertir order[i+1:j+1] para cada j en i+2..n-1
+            a, b = order[i], order[i + 1]
+            c = order[i + 2:]
+            delta = dist(c, a) - dist(a, b)
+            delta[:-1] += dist(order[i + 3:], b) - dist(order[i + 3:], c[:-1])
+            j = int(np.argmin(delta))
+            if delta[j] < -1e-6:
+                j += i + 2
+                order[i + 1:j + 1] = order[i + 1:j + 1][::-1].copy()
+                improved = True
+    return order
+
+
+def or_opt(dist, order, deadline, max_segment=3):
+    order = np.array(order, dtype=np.int64)
+    n = len(order)
+    improved = True
+    while improved and time.perf_counter() < deadline:
+        improved = False
+        for seg in range(1, max_segment + 1):
+            i = 1
+            while i + seg <= n and n - seg >= 2:
+                if time.perf_counter() >= deadline:
+                    return order
+                first, last = order[i], order[i + seg - 1]
+                has_next = i + seg < n
+                if has_next:
+                    gain = dist(order[i - 1], first) + dist(last, order[i + seg]) - dist(order[i - 1], order[i + seg])
+                else:
+                    gain = dist(order[i - 1], first)
+                rest = np.concatenate([order[:i], order[i + seg:]])
+                base = dist(rest[:-1], rest[1:])
+                cost_fwd = dist(rest[:-1], first) + dist(last, rest[1:]) - base
+                cost_rev = dist(rest[:-1], last) + dist(first, rest[1:]) - base
+                if has_next:
+                    cost_fwd[i - 1] = np.inf  # misma posición
+                end_fwd = dist(rest[-1], first) if has_next else np.inf
+                end_rev = dist(rest[-1], last)
+                options = [cost_fwd.min(), cost_rev.min(), end_fwd, end_rev]
+                best = int(np.argmin(options))
+                if gain - options[best] > 1e-6:
+                    segment = order[i:i + seg]
+                    if best in (1, 3):
+                        segment = segment[::-1]
+                    if best in (0, 1):
+                        k = int(np.argmin(cost_fwd if best == 0 else cost_rev)) + 1
+                        order = np.concatenate([rest[:k], segment, rest[k:]])
+                    else:
+                        order = np.concatenate([rest, segment])
+                    improved = True
+                    continue
+                i += 1
+    return order
+
+
+def improve_route(points, order, time_budget, dist=None):
+    # points: coordenadas proyectadas (m); si se indica dist, se usa esa distancia en su lugar
+    dist = dist or euclidean(points)
+    deadline = time.perf_counter() + time_budget
+    order = two_opt(dist, order, deadline)
+    return or_opt(dist, order, deadline)
+
+
+# -------------------------------
+# API del ordenamiento
+# -------------------------------
+def cluster_engine(engine, size):
+    # Motor con el que se ordena de verdad un grupo de `size` calles
+    return "auto" if engine == "network" and size > MATRIX_MAX_SIZE else engine
+
+
+def distance_kind(engine):
+    # "network" o "auto": kdtree y haversine miden en línea recta igual que "auto"
+    return "network" if engine == "network" else "auto"
+
+
+def order_cluster(street_set, indices, engine="auto", improve=False, time_budget=0.5):
+    # engine="network": distancias por la red de calles (ver routing.py) en lugar de en línea recta
+    indices = np.asarray(indices, dtype=np.int64)
+    engine = cluster_engine(engine, len(indices))
+    if engine == "auto":
+        engine = "kdtree" if len(indices) >= KDTREE_MIN_SIZE else "haversine"
+    if len(indices) < 2:
+        return RouteOrder(indices, 0.0, engine)
+    if engine == "network":
+        return order_by_network(street_set, indices, improve, time_budget)
+    latlon = street_set.centroids[indices]
+    # Igual que antes, el recorrido comienza en la primera calle del grupo
+    local = ENGINES[engine](latlon, 0)
+    if improve and len(indices) > 3 and time_budget > 0:
+        local = improve_route(project(latlon), local, time_budget)
+    return RouteOrder(indices[local], path_length_km(latlon, local), engine)
+
+
+def order_by_network(street_set, indices, improve=False, time_budget=0.5):
+    # La matriz de distancias se calcula una vez por grupo y queda guardada en el grafo del territorio
+    matrix = road_graph(street_set).distance_matrix(indices)
+    local = nearest_neighbour_matrix(matrix, 0)
+    if improve and len(indices) > 3 and time_budget > 0:
+        local = improve_route(None, local, time_budget, dist=from_matrix(matrix))
+    length = float(matrix[local[:-1], local[1:]].sum())
+    return RouteOrder(indices[local], length, "network")
@@ -0,0 +1,214 @@
+import argparse
+import json
+import os
+import sqlite3
+import time
+import xml.etree.ElementTree as ET
+from contextlib import closing
+
+import numpy as np
+
+from geo_agent.geometry import boundary_shape
+from geo_agent.overpass import clip_elements
+from geo_agent.settings import cache_path
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS fuente (
+    archivo TEXT,
+    importado REAL,
+    total INTEGER
+);
+CREATE TABLE IF NOT EXISTS vias (
+    id INTEGER PRIMARY KEY,
+    nombre TEXT NOT NULL,
+    tags TEXT NOT NULL,
+    geometria BLOB NOT NULL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS vias_rtree USING rtree(id, min_lon, max_lon, min_lat, max_lat);
+"""
+
+INSERT_BATCH = 5000
+
+
+def default_db_path():
+    return os.environ.get("GEO_AGENT_OSM_EXTRACT_DB") or cache_path("osm_streets.sqlite")
+
+
+def is_street(tags):
+    # Mismo criterio que la consulta a Overpass: way["highway"]["name"]
+    return "highway" in tags and bool(tags.get("name"))
+
+
+# -------------------------------
+# Lectura de extractos OSM
+# -------------------------------
+def read_osm_xml(path):
+    # Primera pasada: vías con nombre y los nodos que necesitan. Segunda: coordenadas de esos nodos.
+    ways, needed = [], set()
+    for _, elem in ET.iterparse(path, events=("end",)):
+        if elem.tag == "way":
+            tags = {tag.get("k"): tag.get("v") for tag in elem.iter("tag")}
+            if is_street(tags):
+                refs = [int(nd.get("ref")) for nd in elem.iter("nd")]
+                ways.append((int(elem.get("id")), tags, refs))
+                needed.update(refs)
+            elem.clear()
+        elif elem.tag in ("node", "relation"):
+            elem.clear()
+
+    coords = {}
+    for _, elem in ET.iterparse(path, events=("end",)):
+        if elem.tag == "node":
+            node_id = int(elem.get("id"))
+            if node_id in needed:
+                coords[node_id] = (float(elem.get("lat")), float(elem.get("lon")))
+        if elem.tag in ("node", "way", "relation"):
+            elem.clear()
+
+    for way_id, tags, refs in ways:
+        points = [coords[ref] for ref in refs if ref in coords]
+        if points:
+            yield way_id, tags, points
+
+
+def read_osm_pbf(path):
+    try:
+        import osmium
+    except ImportError as e:
+        raise ImportError("Para leer archivos .osm.pbf hace falta instalar 'osmium' (pip install osmium)") from e
+
+    ways = []
+
+    class StreetHandler(osmium.SimpleHandler):
+        def way(self, w):
+            tags = {tag.k: tag.v for tag in w.tags}
+            if not is_street(tags):
+                return
+            points = [(node.lat, node.lon) for node in w.nodes if node.location.valid()]
+            if points:
+                ways.append((w.id, tags, points))
+
+    StreetHandler().apply_file(path, locations=True)
+    return ways
+
+
+def read_extract(path):
+    if path.endswith(".pbf"):
+        return read_osm_pbf(path)
+    return read_osm_xml(path)
+
+
+# -------------------------------
+# Base de calles indexada (SQLite + R-tree sobre el rectángulo de cada vía)
+# -------------------------------
+class StreetDatabase:
+    def __init__(self, path=None):
+        self.path = path or default_db_path()
+        with closing(self._connect()) as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def is_empty(self):
+        with closing(self._connect()) as conn:
+            return conn.execute("SELECT 1 FROM vias LIMIT 1").fetchone() is None
+
+    def info(self):
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT archivo, importado, total FROM fuente").fetchone()
+        return None if row is None else {"archivo": row[0], "importado": row[1], "total": row[2]}
+
+    def ingest(self, path):
+        total = 0
+        with closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM vias")
+            conn.execute("DELETE FROM vias_rtree")
+            conn.execute("DELETE FROM fuente")
+            rows, boxes = [], []
+            for way_id, tags, points in read_extract(path):
+                latlon = np.asarray(points, dtype=np.float64)
+                rows.append((way_id, tags["name"], json.dumps(tags, ensure_ascii=False), latlon.tobytes()))
+                boxes.append((way_id, latlon[:, 1].min(), latlon[:, 1].max(), latlon[:, 0].min(), latlon[:, 0].max()))
+                if len(rows) >= INSERT_BATCH:
+                    total += self._insert(conn, rows, boxes)
+                    rows, boxes = [], []
+            total += self._insert(conn, rows, boxes)
+            conn.execute("INSERT INTO fuente (archivo, importado, total) VALUES (?, ?, ?)", (os.path.abspath(path), time.time(), total))
+        return total
+
+    @staticmethod
+    def _insert(conn, rows, boxes):
+        conn.executemany("INSERT OR REPLACE INTO vias (id, nombre, tags, geometria) VALUES (?, ?, ?, ?)", rows)
+        conn.executemany("INSERT OR REPLACE INTO vias_rtree (id, min_lon, max_lon, min_lat, max_lat) VALUES (?, ?, ?, ?, ?)", boxes)
+        return len(rows)
+
+    def query_bbox(self, south, west, north, east):
+        # Devuelve elementos con la misma forma que `out geom` de Overpass
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                """
+                SELECT v.id, v.tags, v.geometria
+                FROM vias_rtree r JOIN vias v ON v.id = r.id
+                WHERE r.max_lon >= ? AND r.min_lon <= ? AND r.max_lat >= ? AND r.min_lat <= ?
+                ORDER BY v.id
+                """,
+                (west, east, south, north),
+            ).fetchall()
+        elements = []
+        for way_id, tags, blob in rows:
+            latlon = np.frombuffer(blob, dtype=np.float64).reshape(-1, 2)
+            elements.append({
+                "type": "way",
+                "id": way_id,
+                "tags": json.loads(tags),
+                "geometry": [{"lat": lat, "lon": lon} for lat, lon in latlon.tolist()],
+            })
+        return elements
+
+    def streets_in_boundary(self, boundary):
+        shape = boundary_shape(boundary)
+        min_lon, min_lat, max_lon, max_lat = shape.bounds
+        return clip_elements(self.query_bbox(min_lat, min_lon, max_lat, max_lon), shape)
+
+    # Misma interfaz que StreetFetcher para poder usarlo como fuente de calles
+    fetch = streets_in_boundary
+
+
+def open_street_database(path=None):
+    # Devuelve la base local sólo si ya se importó un extracto
+    path = path or default_db_path()
+    if not os.path.exists(path):
+        return None
+    db = StreetDatabase(path)
+    return None if db.is_empty() else db
+
+
+# -------------------------------
+# Línea de comandos: python -m geo_agent.osm_extract ingest dominican-republic-latest.osm.pbf
+# -------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Gestiona la base local de calles a partir de un extracto de OSM.")
+    parser.add_argument("--db", help="Ruta del archivo SQLite de calles")
+    sub = parser.add_subparsers(dest="command", required=True)
+    ingest = sub.add_parser("ingest", help="Importa un extracto .osm o .osm.pbf (reemplaza el contenido anterior)")
+    ingest.add_argument("path")
+    sub.add_parser("info", help="Muestra el extracto importado")
+
+    args = parser.parse_args(argv)
+    db = StreetDatabase(args.db)
+    if args.command == "ingest":
+        start = time.perf_counter()
+        total = db.ingest(args.path)
+        print(f"{total} calles importadas en {time.perf_counter() - start:.1f} s -> {db.path}")
+    else:
+        info = db.info()
+        if info is None:
+            print("No hay ningún extracto importado")
+        else:
+            fecha = time.strftime("%Y-%m-%d %H:%M", time.localtime(info["importado"]))
+            print(f"{info['total']} calles ({fecha}) <- {info['archivo']}")
+
+
+if __name__ == "__main__":
+    main()
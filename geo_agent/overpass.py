@@ -0,0 +1,284 @@
+import gzip
+import hashlib
+import json
+import math
+import os
+import threading
+import time
+
+import numpy as np
+import shapely
+
+from geo_agent.geometry import boundary_shape, way_geometries
+from geo_agent.instrumentation import count
+from geo_agent.net import DEFAULT_TIMEOUT, post_json, run_concurrently
+from geo_agent.settings import cache_dir
+
+OVERPASS_URL = "http://overpass-api.de/api/interpreter"
+
+# Filtro de calles usado en todas las consultas
+STREET_FILTER = 'way["highway"]["name"]'
+
+# Tamaño de las teselas fijas (grados). Áreas que se solapan reutilizan las teselas ya descargadas.
+TILE_DEG = 0.05
+# Teselas pedidas en una misma consulta a Overpass
+TILES_PER_REQUEST = 64
+# Consultas simultáneas a Overpass (la instancia pública admite dos por cliente)
+OVERPASS_CONCURRENCY = int(os.environ.get("GEO_AGENT_OVERPASS_CONCURRENCY", 2))
+
+CACHE_TTL = float(os.environ.get("GEO_AGENT_OVERPASS_TTL", 7 * 24 * 3600))
+CACHE_MAX_BYTES = int(os.environ.get("GEO_AGENT_OVERPASS_MAX_BYTES", 512 * 1024 * 1024))
+
+
+def offline_enabled():
+    return os.environ.get("GEO_AGENT_OFFLINE", "").lower() in ("1", "true", "yes")
+
+
+class OfflineCacheMiss(Exception):
+    pass
+
+
+# -------------------------------
+# Caché en disco direccionada por contenido (hash de la consulta de cada tesela)
+# -------------------------------
+class OverpassCache:
+    def __init__(self, path=None, ttl=CACHE_TTL, max_bytes=CACHE_MAX_BYTES):
+        self.path = path or cache_dir("overpass")
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(self.path, exist_ok=True)
+        self._size = sum(size for _, size, _ in self._entries())
+
+    @staticmethod
+    def key(query):
+        return hashlib.sha256(query.encode("utf-8")).hexdigest()
+
+    def _file(self, key):
+        return os.path.join(self.path, key[:2], f"{key}.json.gz")
+
+    def _entries(self):
+        for root, _, files in os.walk(self.path):
+            for name in files:
+                if name.endswith(".json.gz"):
+                    file = os.path.join(root, name)
+                    try:
+                        stat = os.stat(file)
+                    except FileNotFoundError:
+                        continue
+                    yield file, stat.st_size, stat.st_mtime
+
+    def get(self, key, allow_stale=False):
+        file = self._file(key)
+        try:
+            with gzip.open(file, "rt", encoding="utf-8") as f:
+                payload = json.load(f)
+        except (FileNotFoundError, OSError, ValueError):
+            return None
+        if not allow_stale and time.time() - payload.get("fetched_at", 0) > self.ttl:
+            return None
+        # La fecha de modificación marca el último uso (LRU)
+        try:
+            os.utime(file)
+        except FileNotFoundError:
+            pass
+        return payload["elements"]
+
+    def put(self, key, query, elements):
+        file = self._file(key)
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+        tmp = f"{file}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with gzip.open(tmp, "wt", encoding="utf-8") as f:
+            json.dump({"fetched_at": time.time(), "query": query, "elements": elements}, f, separators=(",", ":"))
+        with self._lock:
+            old = os.path.getsize(file) if os.path.exists(file) else 0
+            os.replace(tmp, file)
+            self._size += os.path.getsize(file) - old
+            if self._size > self.max_bytes:
+                self.evict()
+
+    def evict(self):
+        # Elimina los archivos usados hace más tiempo hasta quedar por debajo del límite
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        for file, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(file)
+                total -= size
+            except FileNotFoundError:
+                pass
+        self._size = total
+
+    def stats(self):
+        entries = list(self._entries())
+        return {"archivos": len(entries), "bytes": sum(size for _, size, _ in entries), "max_bytes": self.max_bytes}
+
+
+# -------------------------------
+# Teselas
+# -------------------------------
+def tile_bounds(tile, tile_deg=TILE_DEG):
+    ix, iy = tile
+    # (sur, oeste, norte, este) como espera Overpass
+    return (round(iy * tile_deg, 6), round(ix * tile_deg, 6), round((iy + 1) * tile_deg, 6), round((ix + 1) * tile_deg, 6))
+
+
+def tile_query(tile, tile_deg=TILE_DEG):
+    s, w, n, e = tile_bounds(tile, tile_deg)
+    return f"{STREET_FILTER}({s},{w},{n},{e});"
+
+
+def tiles_for_shape(shape, tile_deg=TILE_DEG):
+    min_lon, min_lat, max_lon, max_lat = shape.bounds
+    xs = np.arange(math.floor(min_lon / tile_deg), math.floor(max_lon / tile_deg) + 1)
+    ys = np.arange(math.floor(min_lat / tile_deg), math.floor(max_lat / tile_deg) + 1)
+    ix, iy = [a.ravel() for a in np.meshgrid(xs, ys)]
+    boxes = shapely.box(ix * tile_deg, iy * tile_deg, (ix + 1) * tile_deg, (iy + 1) * tile_deg)
+    inside = shapely.intersects(shape, boxes)
+    return [(int(x), int(y)) for x, y in zip(ix[inside], iy[inside])]
+
+
+def split_by_tile(elements, tiles, tile_deg=TILE_DEG):
+    # Reparte los elementos de una consulta combinada entre las teselas que tocan
+    wanted = set(tiles)
+    result = {tile: [] for tile in tiles}
+    for element in elements:
+        geometry = element.get("geometry")
+        if not geometry:
+            continue
+        lats = [pt["lat"] for pt in geometry]
+        lons = [pt["lon"] for pt in geometry]
+        for ix in range(math.floor(min(lons) / tile_deg), math.floor(max(lons) / tile_deg) + 1):
+            for iy in range(math.floor(min(lats) / tile_deg), math.floor(max(lats) / tile_deg) + 1):
+                if (ix, iy) in wanted:
+                    result[(ix, iy)].append(element)
+    return result
+
+
+def clip_elements(elements, shape):
+    # Conserva las vías que se cruzan con el límite real (todas sus partes, descontando los huecos)
+    elements = [element for element in elements if element.get("geometry")]
+    if not elements:
+        return []
+    counts = np.fromiter((len(element["geometry"]) for element in elements), dtype=np.int64, count=len(elements))
+    coords = np.array([(pt["lon"], pt["lat"]) for element in elements for pt in element["geometry"]], dtype=np.float64)
+    geoms = way_geometries(coords, np.repeat(np.arange(len(elements)), counts), counts)
+    shapely.prepare(shape)
+    keep = shapely.intersects(shape, geoms)
+    return [element for element, inside in zip(elements, keep) if inside]
+
+
+# -------------------------------
+# Consulta por polígono: una cláusula poly por cada parte del (Multi)Polygon,
+# simplificada para no superar el tamaño razonable de una consulta
+# -------------------------------
+MAX_QUERY_POINTS = 1000
+
+
+def query_shape(shape, max_points=MAX_QUERY_POINTS):
+    # Sólo los anillos exteriores; los huecos se descuentan después al recortar localmente.
+    # Se amplía antes de simplificar para que el polígono consultado contenga siempre al original.
+    parts = list(shape.geoms) if hasattr(shape, "geoms") else [shape]
+    outer = shapely.union_all([shapely.Polygon(part.exterior) for part in parts if part.geom_type == "Polygon"])
+    tolerance = 0.0
+    simplified = outer
+    while shapely.get_num_coordinates(simplified) > max_points:
+        tolerance = tolerance * 2 if tolerance else 0.0005
+        simplified = outer.buffer(tolerance).simplify(tolerance, preserve_topology=True)
+    return simplified
+
+
+def build_overpass_query_polygon(geometry, max_points=MAX_QUERY_POINTS, timeout=25):
+    if geometry.get("type") not in ("Polygon", "MultiPolygon"):
+        return ""
+    shape = query_shape(boundary_shape(geometry), max_points)
+    parts = list(shape.geoms) if hasattr(shape, "geoms") else [shape]
+    clauses = []
+    for part in parts:
+        coords = shapely.get_coordinates(part.exterior)
+        poly_string = " ".join(f"{lat:.6f} {lon:.6f}" for lon, lat in coords)
+        clauses.append(f'  {STREET_FILTER}(poly:"{poly_string}");')
+    body = "\n".join(clauses)
+    return f"[out:json][timeout:{timeout}];\n(\n{body}\n);\nout geom;"
+
+
+# -------------------------------
+# Descarga de calles por teselas
+# -------------------------------
+class StreetFetcher:
+    def __init__(self, cache=None, offline=None, url=OVERPASS_URL, tile_deg=TILE_DEG, local_source=None, timeout=90,
+                 strategy=None):
+        self.cache = cache if cache is not None else OverpassCache()
+        # "tiles": teselas fijas reutilizables; "polygon": una consulta por el contorno simplificado
+        self.strategy = strategy or os.environ.get("GEO_AGENT_FETCH_STRATEGY", "tiles")
+        self.offline = offline_enabled() if offline is None else offline
+        self.url = url
+        self.tile_deg = tile_deg
+        # local_source(sur, oeste, norte, este) -> elementos, p. ej. un extracto local de OSM;
+        # si está configurado, las teselas que faltan en la caché se sirven desde ahí y no desde la red
+        self.local_source = local_source
+        self.timeout = timeout
+
+    def post(self, query):
+        # El tiempo de lectura supera el [timeout] de la consulta para recibir la respuesta del servidor
+        return post_json(self.url, data={"data": query}, timeout=(DEFAULT_TIMEOUT[0], self.timeout + 30)).get("elements", [])
+
+    def fetch_tiles(self, tiles):
+        found, missing = {}, []
+        for tile in tiles:
+            elements = self.cache.get(self.cache.key(tile_query(tile, self.tile_deg)), allow_stale=self.offline)
+            if elements is None:
+                missing.append(tile)
+            else:
+                found[tile] = elements
+        count("teselas_en_cache", len(found))
+        count("teselas_pendientes", len(missing))
+        if missing and self.local_source is not None:
+            for tile in missing:
+                found[tile] = self.local_source(*tile_bounds(tile, self.tile_deg))
+            missing = []
+        if missing and self.offline:
+            raise OfflineCacheMiss(f"Modo sin conexión: faltan {len(missing)} teselas en la caché")
+        batches = [missing[start:start + TILES_PER_REQUEST] for start in range(0, len(missing), TILES_PER_REQUEST)]
+        for batch_found in run_concurrently([lambda batch=batch: self.fetch_batch(batch) for batch in batches],
+                                            OVERPASS_CONCURRENCY):
+            found.update(batch_found)
+        return found
+
+    def fetch_batch(self, batch):
+        body = "\n".join(tile_query(tile, self.tile_deg) for tile in batch)
+        query = f"[out:json][timeout:{self.timeout}];\n(\n{body}\n);\nout geom;"
+        by_tile = split_by_tile(self.post(query), batch, self.tile_deg)
+        for tile, elements in by_tile.items():
+            self.cache.put(self.cache.key(tile_query(tile, self.tile_deg)), tile_query(tile, self.tile_deg), elements)
+        return by_tile
+
+    def fetch_polygon(self, boundary, shape):
+        query = build_overpass_query_polygon(boundary, timeout=self.timeout)
+        if not query:
+            return []
+        key = self.cache.key(query)
+        elements = self.cache.get(key, allow_stale=self.offline)
+        if elements is None:
+            if self.local_source is not None:
+                min_lon, min_lat, max_lon, max_lat = shape.bounds
+                return clip_elements(self.local_source(min_lat, min_lon, max_lat, max_lon), shape)
+            if self.offline:
+                raise OfflineCacheMiss("Modo sin conexión: la consulta del perímetro no está en la caché")
+            elements = self.post(query)
+            self.cache.put(key, query, elements)
+        return clip_elements(elements, shape)
+
+    def fetch(self, boundary):
+        shape = boundary_shape(boundary)
+        if self.strategy == "polygon":
+            return self.fetch_polygon(boundary, shape)
+        by_tile = self.fetch_tiles(tiles_for_shape(shape, self.tile_deg))
+        # Una vía que cruza varias teselas aparece en todas; se deja una sola copia (en orden de id, como Overpass)
+        unique = {}
+        for elements in by_tile.values():
+            for element in elements:
+                unique.setdefault(element.get("id"), element)
+        return clip_elements([unique[key] for key in sorted(unique)], shape)
@@ -0,0 +1,285 @@
+import os
+
+import numpy as np
+import shapely
+
+from geo_agent.assignment import build_assignment, generate_agent_colors
+from geo_agent.boundary_store import BoundaryStore
+from geo_agent.clustering import adjust_clusters, cluster_streets
+from geo_agent.export import generate_dataframe
+from geo_agent.geometry import boundary_shape, bounds_in, street_geometries
+from geo_agent.instrumentation import stage
+from geo_agent.net import run_concurrently
+from geo_agent.osm_extract import open_street_database
+from geo_agent.overpass import StreetFetcher
+from geo_agent.shared_cache import shared_cache
+from geo_agent.streets import StreetSet
+
+# Tiempo máximo (segundos) de mejora 2-opt/Or-opt de una asignación, repartido entre los agentes según sus calles
+ROUTE_TIME_BUDGET = 2.0
+# Distancia usada para ordenar las calles: "network" (por la red de calles) o "auto" (línea recta entre centroides)
+ROUTE_ENGINE = os.environ.get("GEO_AGENT_ROUTE_ENGINE", "network")
+# Por encima de este número de calles el ordenamiento por la red tarda más del doble que en línea recta
+# y el territorio se ordena en línea recta aunque se pida "network"
+NETWORK_MAX_STREETS = int(os.environ.get("GEO_AGENT_NETWORK_MAX_STREETS", 20000))
+
+ALL = "Todos"
+
+# Capas de límites de cada nivel, del más fino al más grueso
+BOUNDARY_CASCADE = [
+    ("barrios", 4),
+    ("secciones", 3),
+    ("distritos", 2),
+    ("municipios", 1),
+    ("provincias", 0),
+]
+
+
+# -------------------------------
+# Límites administrativos
+# -------------------------------
+def ensure_layers(layers, store=None):
+    # Las capas que faltan se descargan a la vez; devuelve {capa: error} de las que fallaron
+    store = store or BoundaryStore()
+    missing = [layer for layer in layers if not store.has_layer(layer)]
+    if not missing:
+        return {}
+
+    def refresh(layer):
+        try:
+            store.refresh(layer)
+        except Exception as e:
+            return layer, e
+        return layer, None
+
+    with stage("descarga_capas", capas=len(missing)):
+        results = run_concurrently([lambda layer=layer: refresh(layer) for layer in missing], concurrency=len(missing))
+    return {layer: error for layer, error in results if error is not None}
+
+
+def resolve_entity(store, layer, value, parent=None):
+    # Los nombres se repiten entre territorios (p. ej. «PUEBLO NUEVO» en decenas de municipios): se elige la
+    # entidad cuyo código cuelga del de su padre o, si el padre no tiene código (provincias), la que queda dentro de él
+    if parent is None:
+        found = store.candidates(layer, value)
+        return found[0] if found else None
+    if parent["codigo_padre"]:
+        found = store.candidates(layer, value, parent=parent["codigo_padre"])
+        if found:
+            return found[0]
+    found = store.candidates(layer, value, bbox=bounds_in(parent["geometry"], store.layer_crs(layer)))
+    if len(found) > 1:
+        shape = boundary_shape(parent["geometry"])
+        inside = [entity for entity in found if shape.contains(boundary_shape(entity["geometry"]).representative_point())]
+        found = inside or found
+    return found[0] if found else None
+
+
+def get_boundary(selected_prov, selected_muni, selected_dist, selected_secc, selected_barrio, store=None, on_error=None):
+    # Devuelve el perímetro del nivel más fino encontrado; cada nivel se busca dentro del anterior.
+    # on_error(mensaje): si se indica, un fallo al cargar una capa se informa y se sigue con el nivel superior
+    store = store or BoundaryStore()
+    selected = [selected_prov, selected_muni, selected_dist, selected_secc, selected_barrio]
+    cascade = [(layer, selected[level]) for layer, level in BOUNDARY_CASCADE if selected[level] and selected[level] != ALL]
+    with stage("limites"):
+        errors = ensure_layers([layer for layer, _ in cascade], store)
+        found, found_layer = None, None
+        for layer, value in reversed(cascade):
+            if layer in errors:
+                continue
+            entity = resolve_entity(store, layer, value, parent=found)
+            if entity:
+                found, found_layer = entity, layer
+        # Sólo importan los fallos de las capas más finas que la encontrada
+        for layer, _ in cascade:
+            if layer == found_layer:
+                break
+            if layer in errors:
+                if on_error is None:
+                    raise errors[layer]
+                on_error(f"Error al cargar la capa {layer}: {errors[layer]}")
+    return found["geometry"] if found else None
+
+
+# -------------------------------
+# Calles
+# -------------------------------
+def open_street_source():
+    # Si se importó un extracto local de OSM, las calles se consultan ahí en lugar de en Overpass
+    return open_street_database() or StreetFetcher()
+
+
+def get_streets_by_polygon(boundary, source=None):
+    source = source or open_street_source()
+    with stage("calles") as counts:
+        elements = source.fetch(boundary) or None
+        counts["elementos"] = len(elements or [])
+    return elements
+
+
+def get_street_set(boundary, source=None):
+    elements = get_streets_by_polygon(boundary, source)
+    with stage("conjunto_calles") as counts:
+        street_set = StreetSet.from_elements(elements)
+        counts["calles"] = len(street_set)
+        counts["puntos"] = len(street_set.lat)
+    return street_set
+
+
+def clip_street_set(street_set, boundary):
+    # Calles de un conjunto ya descargado que se cruzan con un límite (mismo criterio que al descargar)
+    shape = boundary_shape(boundary)
+    shapely.prepare(shape)
+    keep = np.flatnonzero(shapely.intersects(shape, street_geometries(street_set)))
+    return street_set.subset(keep)
+
+
+def reuse_street_set(boundary, candidates):
+    # candidates: pares (límite, conjunto de calles) ya descargados. Si alguno de esos límites contiene
+    # por completo al nuevo (p. ej. un barrio dentro del municipio ya cargado), sus calles se recortan
+    # en memoria en lugar de volver a consultarlas; si no, devuelve None.
+    shape = boundary_shape(boundary)
+    for candidate_boundary, street_set in candidates:
+        if boundary_shape(candidate_boundary).covers(shape):
+            with stage("conjunto_calles", reutilizado=1) as counts:
+                subset = clip_street_set(street_set, boundary)
+                counts["calles"] = len(subset)
+                counts["puntos"] = len(subset.lat)
+            return subset
+    return None
+
+
+# -------------------------------
+# Asignación y ordenamiento
+# -------------------------------
+def route_engine(engine, street_set):
+    # Motor pedido para todo el territorio (meta["ordenamiento"]); los grupos de más de MATRIX_MAX_SIZE
+    # calles se ordenan además en línea recta, y el motor de cada agente queda en meta["motores"]
+    return "auto" if engine == "network" and len(street_set) > NETWORK_MAX_STREETS else engine
+
+
+def plan_streets(street_set, num_agents, boundary=None, backend="auto", time_budget=ROUTE_TIME_BUDGET, colors=None,
+                 engine=ROUTE_ENGINE):
+    engine = route_engine(engine, street_set)
+    with stage("agrupacion", calles=len(street_set), agentes=num_agents):
+        clustering = cluster_streets(street_set, num_agents, backend)
+    with stage("ordenamiento", calles=len(street_set)):
+        return build_assignment(street_set, clustering.clusters, colors or generate_agent_colors(num_agents), boundary,
+                                time_budget=time_budget, meta={"clustering": clustering.stats, "ordenamiento": engine},
+                                engine=engine, clustering=clustering)
+
+
+def replan_streets(previous, num_agents, time_budget=ROUTE_TIME_BUDGET, engine=ROUTE_ENGINE, backend=None):
+    # Reajusta una asignación anterior del mismo territorio a otro número de agentes: se dividen o se
+    # reparten sólo los grupos necesarios y se vuelven a ordenar sólo los que cambiaron de calles.
+    # backend: método de agrupación si hay que empezar de cero; por defecto, el de la asignación anterior
+    if previous.clustering is None:
+        backend = backend or (previous.meta.get("clustering") or {}).get("backend", "auto")
+        return plan_streets(previous.street_set, num_agents, previous.boundary, backend, time_budget, engine=engine)
+    street_set = previous.street_set
+    engine = route_engine(engine, street_set)
+    with stage("agrupacion", calles=len(street_set), agentes=num_agents, incremental=1):
+        clustering = adjust_clusters(street_set, previous.clustering, num_agents)
+    # Cada agente conserva su color; los nuevos reciben uno al azar
+    colors = {**generate_agent_colors(num_agents), **{a: c for a, c in previous.colors.items() if a < num_agents}}
+    # build_assignment sólo reutiliza los recorridos medidos igual que ahora (ver meta["motores"])
+    with stage("ordenamiento", calles=len(street_set)) as counts:
+        result = build_assignment(street_set, clustering.clusters, colors, previous.boundary, time_budget=time_budget,
+                                  meta={"clustering": clustering.stats, "ordenamiento": engine}, engine=engine,
+                                  previous=previous, clustering=clustering)
+        counts["recorridos_reutilizados"] = result.meta.get("recorridos_reutilizados", 0)
+    return result
+
+
+def plan_territory(territory, num_agents, backend="auto", time_budget=ROUTE_TIME_BUDGET, store=None, source=None,
+                   engine=ROUTE_ENGINE):
+    # territory: (Provincia, Municipio, Distrito Municipal, Sección, Barrio)
+    boundary = get_boundary(*territory, store=store)
+    if not boundary:
+        return None
+    street_set = get_street_set(boundary, source)
+    if not len(street_set):
+        return None
+    return plan_streets(street_set, num_agents, boundary, backend, time_budget, engine=engine)
+
+
+# -------------------------------
+# Versiones con la caché compartida del proceso, usadas por la interfaz y por el servicio.
+# Las claves son las mismas en ambos, así que lo que calcula uno lo aprovecha el otro.
+# -------------------------------
+def territory_key(territory):
+    # La interfaz marca con "Todos" los niveles sin elegir y el servicio con None: en las claves siempre es None
+    return tuple(None if value in (None, "", ALL) else value for value in territory)
+
+
+def cached_boundary(territory, store=None, on_error=None):
+    # on_error como en get_boundary; si falló alguna capa el resultado no se guarda, para reintentar la próxima vez
+    territory = territory_key(territory)
+    cache = shared_cache()
+    key = ("limite", territory)
+    if key in cache:
+        return cache.get(key)
+    errors = []
+    boundary = get_boundary(*territory, store=store, on_error=errors.append if on_error else None)
+    for message in errors:
+        on_error(message)
+    if not errors:
+        cache.put(key, boundary)
+    return boundary
+
+
+def cached_street_sets(territory):
+    # Conjuntos de calles ya cargados de otros territorios, con su perímetro, para recortar de ahí si contienen al nuevo
+    cache = shared_cache()
+    boundaries = dict(cache.items("limite"))
+    for (_, other), street_set in cache.items("calles"):
+        boundary = boundaries.get(("limite", other))
+        if other != territory and boundary and street_set is not None and len(street_set):
+            yield boundary, street_set
+
+
+def cached_street_set(territory, boundary, source=None):
+    territory = territory_key(territory)
+
+    def load():
+        return reuse_street_set(boundary, cached_street_sets(territory)) or get_street_set(boundary, source)
+
+    return shared_cache().get_or_create(("calles", territory), load)
+
+
+def previous_assignment(territory, num_agents, backend, engine):
+    # Asignación ya calculada del mismo territorio y backend con otro número de agentes (la más cercana),
+    # preferiblemente con el mismo motor de ordenamiento, para reajustarla en lugar de empezar de cero
+    candidates = [
+        (abs(key[2] - num_agents), key[4] != engine, index, result)
+        for index, (key, result) in enumerate(shared_cache().items("asignacion"))
+        if key[1] == territory and key[3] == backend and key[2] != num_agents
+    ]
+    return min(candidates, key=lambda c: c[:3])[3] if candidates else None
+
+
+def cached_assignment(territory, num_agents, backend="auto", engine=ROUTE_ENGINE, load=None, store=None, source=None):
+    # load(): devuelve (límite, conjunto de calles) cuando hay que planificar desde cero;
+    # por defecto, con las versiones en caché de arriba
+    territory = territory_key(territory)
+    cache = shared_cache()
+    key = ("asignacion", territory, num_agents, backend, engine)
+    result = cache.get(key)
+    if result is not None:
+        return result
+    previous = previous_assignment(territory, num_agents, backend, engine)
+    if previous is not None:
+        return cache.get_or_create(key, lambda: replan_streets(previous, num_agents, engine=engine, backend=backend))
+    if load is None:
+        def load():
+            boundary = cached_boundary(territory, store)
+            return boundary, cached_street_set(territory, boundary, source) if boundary else None
+    boundary, street_set = load()
+    if not boundary or street_set is None or not len(street_set):
+        return None
+    return cache.get_or_create(key, lambda: plan_streets(street_set, num_agents, boundary, backend, engine=engine))
+
+
+def cached_table(result, territory):
+    # Tabla de calles de una asignación; las columnas administrativas quedan vacías en los niveles sin elegir
+    return shared_cache().get_or_create(("tabla", result.key), lambda: generate_dataframe(result, *territory_key(territory)))
@@ -0,0 +1,129 @@
+import math
+
+import folium
+import numpy as np
+import shapely
+from shapely.geometry import MultiPoint, Polygon
+
+from geo_agent.geometry import boundary_shape
+from geo_agent.instrumentation import stage
+from geo_agent.shared_cache import shared_cache
+
+MAP_MODES = ["Calles", "Calles (ligero)", "Área"]
+
+# Niveles de zoom extra sobre el encuadre inicial que se quieren ver sin pérdida visible
+DETAIL_ZOOM_MARGIN = 3
+
+
+def degrees_per_pixel(zoom):
+    return 360.0 / (256 * 2 ** zoom)
+
+
+def fit_zoom(bounds, width_px=700, height_px=500):
+    # Zoom con el que el rectángulo (min_lon, min_lat, max_lon, max_lat) cabe en el mapa
+    min_lon, min_lat, max_lon, max_lat = bounds
+    span = max(max_lon - min_lon, (max_lat - min_lat) * width_px / height_px, 1e-6)
+    return int(np.clip(math.floor(math.log2(360.0 * width_px / (256 * span))), 1, 18))
+
+
+def map_center(boundary):
+    if boundary and boundary["type"] in ("Polygon", "MultiPolygon"):
+        # El límite puede venir en EPSG:32619; el centro se calcula siempre en lat/lon
+        centroid = boundary_shape(boundary).centroid
+        return [centroid.y, centroid.x]
+    return [19.0, -70.0]
+
+
+# -------------------------------
+# Capa ligera: un MultiLineString por agente, simplificado y cuantizado según el zoom
+# -------------------------------
+def agent_multilinestring(street_set, indices, zoom):
+    indices = np.asarray(indices, dtype=np.int64)
+    counts = np.diff(street_set.offsets)[indices]
+    indices = indices[counts > 1]
+    if not len(indices):
+        return None
+    tolerance = degrees_per_pixel(zoom + DETAIL_ZOOM_MARGIN) / 2
+    decimals = max(0, math.ceil(-math.log10(tolerance)))
+    mask = np.isin(street_set.point_way, indices)
+    ways = street_set.point_way[mask]
+    # Índices consecutivos para linestrings(); el orden de puntos ya es el de cada vía
+    _, line_index = np.unique(ways, return_inverse=True)
+    lines = shapely.linestrings(street_set.lon[mask], street_set.lat[mask], indices=line_index)
+    lines = shapely.simplify(lines, tolerance)
+    coords, owner = shapely.get_coordinates(lines, return_index=True)
+    coords = np.round(coords, decimals)
+    splits = np.flatnonzero(np.diff(owner)) + 1
+    parts = [part.tolist() for part in np.split(coords, splits)]
+    return {"type": "MultiLineString", "coordinates": parts}
+
+
+def build_map(result, mode, agents=None, on_error=None):
+    street_set = result.street_set
+    m = folium.Map(location=map_center(result.boundary), zoom_start=13, tiles="cartodbpositron",
+                   prefer_canvas=mode == "Calles (ligero)")
+    if len(street_set):
+        min_lat, min_lon = street_set.bboxes[:, :2].min(axis=0)
+        max_lat, max_lon = street_set.bboxes[:, 2:].max(axis=0)
+        zoom = fit_zoom((min_lon, min_lat, max_lon, max_lat))
+    else:
+        zoom = 13
+    for agent in result.select(agents):
+        color = result.colors.get(agent, "#000000")
+        feature_group = folium.FeatureGroup(name=f"Agente {agent+1}")
+        if mode == "Calles":
+            for i in result.orders[agent]:
+                folium.PolyLine(
+                    street_set.coords(i).tolist(),
+                    color=color,
+                    weight=4,
+                    tooltip=street_set.names[i]
+                ).add_to(feature_group)
+        elif mode == "Calles (ligero)":
+            geometry = agent_multilinestring(street_set, result.orders[agent], zoom)
+            if geometry:
+                folium.GeoJson(
+                    data={"type": "Feature", "geometry": geometry, "properties": {}},
+                    style_function=lambda x, col=color: {"color": col, "weight": 4},
+                    tooltip=f"Agente {agent+1}: {len(result.orders[agent])} calles, {result.tour_km.get(agent, 0):.1f} km",
+                ).add_to(feature_group)
+        elif mode == "Área":
+            points = street_set.points_of(result.orders[agent])
+            if len(points):
+                try:
+                    polygon = MultiPoint(points[:, ::-1]).convex_hull
+                    if isinstance(polygon, Polygon):
+                        folium.GeoJson(
+                            data={
+                                "type": "Feature",
+                                "geometry": {
+                                    "type": "Polygon",
+                                    "coordinates": [list(polygon.exterior.coords)]
+                                }
+                            },
+                            style_function=lambda x, col=color: {
+                                "fillColor": col,
+                                "color": col,
+                                "fillOpacity": 0.4
+                            }
+                        ).add_to(feature_group)
+                except Exception as e:
+                    if on_error is not None:
+                        on_error(f"Error al calcular el área para el Agente {agent+1}: {e}")
+        feature_group.add_to(m)
+    folium.LayerControl().add_to(m)
+    return m
+
+
+def render_map_html(result, mode, agents=None, on_error=None):
+    # El HTML se guarda en la caché compartida por (asignación, modo, filtro de agentes):
+    # los reruns y las demás sesiones que ven la misma asignación no reconstruyen el mapa
+    key = ("mapa", result.key, mode, None if agents is None else tuple(agents))
+
+    def render():
+        with stage("mapa") as counts:
+            html = build_map(result, mode, agents, on_error)._repr_html_()
+            counts["bytes"] = len(html)
+        return html
+
+    return shared_cache().get_or_create(key, render)
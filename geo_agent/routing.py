@@ -0,0 +1,138 @@
+import hashlib
+import itertools
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+
+from geo_agent.instrumentation import count, stage
+from geo_agent.shared_cache import shared_cache
+from geo_agent.streets import haversine_km
+
+# Precisión de OSM (7 decimales): dos puntos con las mismas coordenadas son el mismo nodo
+COORD_SCALE = 1e7
+# Orígenes por llamada a Dijkstra (limita la memoria: lote x nodos del subgrafo)
+DIJKSTRA_BATCH = 256
+# Por encima de este tamaño de grupo la matriz ya no compensa y se ordena por centroides
+MATRIX_MAX_SIZE = 2000
+# Margen alrededor del grupo al recortar el grafo, para admitir rodeos que salen de su rectángulo
+SUBGRAPH_MARGIN_KM = 0.5
+# Pares sin camino dentro del subgrafo: distancia en línea recta penalizada
+DISCONNECTED_FACTOR = 2.0
+
+
+# -------------------------------
+# Grafo de la red de calles en formato CSR
+# Los nodos son los puntos compartidos por las vías (mismas coordenadas) y cada arista une
+# dos puntos consecutivos de una vía, con su longitud en km. Se recorre sin sentido único,
+# como un agente a pie.
+# -------------------------------
+_graph_ids = itertools.count()
+
+
+class RoadGraph:
+    def __init__(self, street_set):
+        lat_key = np.round(street_set.lat * COORD_SCALE).astype(np.int64) + 2**31
+        lon_key = np.round(street_set.lon * COORD_SCALE).astype(np.int64) + 2**31
+        keys = (lat_key.astype(np.uint64) << np.uint64(32)) | lon_key.astype(np.uint64)
+        unique_keys, first, self.point_node = np.unique(keys, return_index=True, return_inverse=True)
+        self.node_lat = street_set.lat[first]
+        self.node_lon = street_set.lon[first]
+        n_nodes = len(unique_keys)
+
+        same_way = street_set.point_way[:-1] == street_set.point_way[1:]
+        u = self.point_node[:-1][same_way]
+        v = self.point_node[1:][same_way]
+        w = haversine_km(street_set.lat[:-1][same_way], street_set.lon[:-1][same_way],
+                         street_set.lat[1:][same_way], street_set.lon[1:][same_way])
+        keep = u != v
+        a, b, w = np.minimum(u, v)[keep], np.maximum(u, v)[keep], w[keep]
+        # Aristas repetidas (vías superpuestas): se conserva la más corta
+        edge = a.astype(np.int64) * n_nodes + b
+        order = np.lexsort((w, edge))
+        edge, a, b, w = edge[order], a[order], b[order], w[order]
+        first_edge = np.ones(len(edge), dtype=bool)
+        first_edge[1:] = edge[1:] != edge[:-1]
+        a, b, w = a[first_edge], b[first_edge], w[first_edge]
+        self.csr = csr_matrix((np.concatenate([w, w]), (np.concatenate([a, b]), np.concatenate([b, a]))),
+                              shape=(n_nodes, n_nodes))
+
+        # Nodo que representa a cada calle: su punto más cercano al centroide
+        centroid = street_set.centroids[street_set.point_way]
+        offset = (street_set.lat - centroid[:, 0]) ** 2 + (street_set.lon - centroid[:, 1]) ** 2
+        by_way = np.lexsort((offset, street_set.point_way))
+        starts = np.searchsorted(street_set.point_way[by_way], np.arange(len(street_set)))
+        self.street_node = self.point_node[by_way[starts]] if len(street_set) else np.empty(0, dtype=np.int64)
+
+        # Identifica las matrices de este grafo en la caché compartida
+        self.id = next(_graph_ids)
+
+    @property
+    def num_nodes(self):
+        return self.csr.shape[0]
+
+    @property
+    def num_edges(self):
+        return self.csr.nnz // 2
+
+    def subgraph(self, nodes):
+        # Recorte del grafo al rectángulo de los nodos más un margen; devuelve el subgrafo y la posición de los nodos en él
+        margin_lat = SUBGRAPH_MARGIN_KM / 111.32
+        margin_lon = margin_lat / max(np.cos(np.radians(self.node_lat[nodes].mean())), 1e-6)
+        lat, lon = self.node_lat[nodes], self.node_lon[nodes]
+        inside = ((self.node_lat >= lat.min() - margin_lat) & (self.node_lat <= lat.max() + margin_lat)
+                  & (self.node_lon >= lon.min() - margin_lon) & (self.node_lon <= lon.max() + margin_lon))
+        keep = np.flatnonzero(inside)
+        position = np.full(self.num_nodes, -1, dtype=np.int64)
+        position[keep] = np.arange(len(keep))
+        return self.csr[keep][:, keep], position[nodes]
+
+    def distance_matrix(self, indices):
+        # Distancias por la red (km) entre las calles indicadas, en ese orden; se guardan por grupo de calles
+        # en la caché compartida, dentro del mismo presupuesto de memoria que el resto de artefactos
+        indices = np.asarray(indices, dtype=np.int64)
+        key = ("matriz", self.id, hashlib.blake2b(indices.tobytes(), digest_size=16).digest())
+        cache = shared_cache()
+        matrix = cache.get(key)
+        if matrix is not None:
+            return matrix
+        nodes, inverse = np.unique(self.street_node[indices], return_inverse=True)
+        count("dijkstra_origenes", len(nodes))
+        sub, local = self.subgraph(nodes)
+        dist = np.empty((len(nodes), len(nodes)))
+        # Dijkstra desde varios orígenes a la vez, por lotes, guardando sólo las columnas de los nodos del grupo
+        for start in range(0, len(nodes), DIJKSTRA_BATCH):
+            batch = local[start:start + DIJKSTRA_BATCH]
+            dist[start:start + len(batch)] = dijkstra(sub, directed=True, indices=batch)[:, local]
+        unreachable = ~np.isfinite(dist)
+        if unreachable.any():
+            i, j = np.nonzero(unreachable)
+            lat, lon = self.node_lat[nodes], self.node_lon[nodes]
+            dist[i, j] = haversine_km(lat[i], lon[i], lat[j], lon[j]) * DISCONNECTED_FACTOR
+        matrix = dist[np.ix_(inverse, inverse)]
+        return cache.put(key, matrix, matrix.nbytes)
+
+
+# -------------------------------
+# Un grafo por conjunto de calles (es decir, por territorio), guardado en la caché compartida
+# con su tamaño real. La entrada conserva el conjunto, así que su id no se reutiliza mientras exista.
+# -------------------------------
+def graph_key(street_set):
+    return ("grafo", id(street_set))
+
+
+def road_graph(street_set):
+    def build():
+        with stage("grafo_calles") as counts:
+            graph = RoadGraph(street_set)
+            graph.street_set = street_set
+            counts["nodos"] = graph.num_nodes
+            counts["aristas"] = graph.num_edges
+        return graph
+
+    return shared_cache().get_or_create(graph_key(street_set), build)
+
+
+def discard_graph(street_set):
+    # Las matrices del grafo quedan sin uso y salen de la caché por antigüedad
+    shared_cache().discard(graph_key(street_set))
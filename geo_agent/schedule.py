@@ -0,0 +1,117 @@
+import numpy as np
+import pandas as pd
+from pandas.tseries.offsets import CustomBusinessDay
+
+from geo_agent.instrumentation import stage
+
+# Día de la semana -> código de la máscara de días laborables de pandas
+WEEKDAYS = {
+    "Lunes": "Mon",
+    "Martes": "Tue",
+    "Miércoles": "Wed",
+    "Jueves": "Thu",
+    "Viernes": "Fri",
+    "Sábado": "Sat",
+    "Domingo": "Sun",
+}
+
+# Criterio para repartir las calles de cada agente en días: número de calles, km de calle o minutos estimados
+SPLIT_MODES = ("calles", "km", "minutos")
+
+# Estimación del tiempo de una calle: recorrerla a pie más un tiempo fijo por calle (llegar, anotar, etc.)
+WALK_SPEED_KMH = 4.0
+MINUTES_PER_STREET = 2.0
+
+
+def parse_holidays(text):
+    # Fechas AAAA-MM-DD separadas por líneas, comas o espacios
+    holidays = []
+    for value in text.replace(",", " ").split():
+        try:
+            holidays.append(pd.Timestamp(value).normalize())
+        except ValueError:
+            raise ValueError(f"Fecha de feriado no válida: {value} (use AAAA-MM-DD)")
+    return holidays
+
+
+def working_dates(start_date, periods, weekdays, holidays=()):
+    # Los `periods` primeros días laborables desde start_date (incluido si lo es), sin recorrer día a día
+    if periods <= 0:
+        return pd.DatetimeIndex([])
+    weekmask = " ".join(WEEKDAYS.get(day, day) for day in weekdays)
+    if not weekmask:
+        raise ValueError("Hay que indicar al menos un día laborable")
+    offset = CustomBusinessDay(weekmask=weekmask, holidays=list(holidays))
+    return pd.date_range(pd.Timestamp(start_date).normalize(), periods=periods, freq=offset)
+
+
+def street_cost(df, split, speed_kmh=WALK_SPEED_KMH, minutes_per_street=MINUTES_PER_STREET):
+    if split == "calles":
+        return np.ones(len(df))
+    if "Km" not in df.columns:
+        raise ValueError(f"Para repartir por {split} la tabla necesita la columna 'Km'")
+    km = df["Km"].to_numpy(dtype=np.float64)
+    if split == "km":
+        return km
+    if split == "minutos":
+        return km / speed_kmh * 60 + minutes_per_street
+    raise ValueError(f"Criterio de reparto desconocido: {split} (opciones: {', '.join(SPLIT_MODES)})")
+
+
+# -------------------------------
+# Calendario de trabajo en una sola pasada
+# Las filas se ordenan por agente y orden de visita; cada calle cae en el día en que empieza
+# según la carga acumulada del agente (calles, km o minutos), de modo que un día supera la
+# capacidad como mucho en la última calle. Las fechas salen de un desplazamiento de días
+# laborables con máscara semanal y feriados.
+# -------------------------------
+def generate_schedule(df, weekdays, start_date, per_day, split="calles", holidays=(),
+                      speed_kmh=WALK_SPEED_KMH, minutes_per_street=MINUTES_PER_STREET):
+    with stage("calendario", filas=len(df)) as counts:
+        schedule = _schedule_frame(df, weekdays, start_date, per_day, split, holidays, speed_kmh, minutes_per_street)
+        counts["dias"] = int(schedule["Día"].max()) if len(schedule) else 0
+    return schedule
+
+
+def _schedule_frame(df, weekdays, start_date, per_day, split, holidays, speed_kmh, minutes_per_street):
+    if per_day <= 0:
+        raise ValueError("La carga por día tiene que ser mayor que cero")
+    if "Order" in df.columns:
+        df = df.sort_values(["Agente", "Order"], kind="stable")
+    else:
+        df = df.sort_values("Agente", kind="stable")
+    n = len(df)
+    agents = df["Agente"].to_numpy()
+    cost = street_cost(df, split, speed_kmh, minutes_per_street)
+
+    # Inicio de cada agente en las filas ordenadas y carga acumulada antes de cada calle
+    new_agent = np.ones(n, dtype=bool)
+    new_agent[1:] = agents[1:] != agents[:-1]
+    agent_start = np.flatnonzero(new_agent)
+    group = np.cumsum(new_agent) - 1
+    cumulative = np.cumsum(cost)
+    before = cumulative - cost
+    load_before = before - before[agent_start][group]
+    raw_day = np.floor(load_before / per_day + 1e-9).astype(np.int64)
+
+    # Una calle más larga que la capacidad deja huecos en la numeración: se compactan los días
+    new_day = new_agent.copy()
+    new_day[1:] |= raw_day[1:] != raw_day[:-1]
+    day_id = np.cumsum(new_day) - 1
+    day = day_id - day_id[agent_start][group]
+    new_day_index = np.flatnonzero(new_day)
+    position = np.arange(n) - new_day_index[day_id]
+
+    dates = working_dates(start_date, int(day.max()) + 1 if n else 0, weekdays, holidays)
+    schedule = pd.DataFrame({
+        "Agente": agents,
+        "Día": day + 1,
+        "Fecha": dates[day] if n else pd.DatetimeIndex([]),
+        "Orden": position + 1,
+        "Calle": df["Calle"].to_numpy(),
+    })
+    if split != "calles":
+        schedule["Km"] = df["Km"].to_numpy()
+    if split == "minutos":
+        schedule["Minutos"] = cost.round(1)
+    return schedule
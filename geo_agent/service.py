@@ -0,0 +1,273 @@
+import argparse
+import datetime
+import json
+import os
+import threading
+import time
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from geo_agent import pipeline
+from geo_agent.batch import JOB_KEYS, expand_jobs, job_id, job_territory
+from geo_agent.boundary_store import BoundaryStore
+from geo_agent.export import assignment_geojson, frame_records, with_schedule
+from geo_agent.instrumentation import run
+from geo_agent.net import run_concurrently
+from geo_agent.schedule import SPLIT_MODES, WEEKDAYS, generate_schedule
+from geo_agent.shared_cache import shared_cache
+
+SERVICE_HOST = os.environ.get("GEO_AGENT_SERVICE_HOST", "127.0.0.1")
+SERVICE_PORT = int(os.environ.get("GEO_AGENT_SERVICE_PORT", 8765))
+# Planes de una misma petición que se calculan a la vez
+SERVICE_CONCURRENCY = int(os.environ.get("GEO_AGENT_SERVICE_CONCURRENCY", 4))
+MAX_REQUEST_BYTES = 1024 * 1024
+MAX_PLANS_PER_REQUEST = 500
+MAX_AGENTS_PER_PLAN = int(os.environ.get("GEO_AGENT_SERVICE_MAX_AGENTS", 500))
+
+# "resumen": sólo cifras por agente; "json": además la tabla de calles; "geojson": la tabla como FeatureCollection
+OUTPUT_FORMATS = ("resumen", "json", "geojson")
+BACKENDS = ("auto", "kmeans", "minibatch", "balanced")
+ENGINES = ("network", "auto")
+DEFAULT_WEEKDAYS = ["Lunes", "Martes", "Miércoles", "Jueves", "Viernes"]
+
+
+class PlanError(ValueError):
+    pass
+
+
+# -------------------------------
+# Almacén de límites y fuente de calles del proceso: se abren una vez y se reutilizan entre peticiones
+# -------------------------------
+_resources = {}
+_resources_lock = threading.Lock()
+
+
+def _resource(name, factory):
+    with _resources_lock:
+        if name not in _resources:
+            _resources[name] = factory()
+        return _resources[name]
+
+
+def boundary_store():
+    return _resource("limites", BoundaryStore)
+
+
+def street_source():
+    return _resource("calles", pipeline.open_street_source)
+
+
+# -------------------------------
+# Un plan: territorio, agentes y opciones -> resultado serializable
+# -------------------------------
+def check_territory(spec):
+    for key in JOB_KEYS:
+        if not isinstance(spec.get(key), (str, type(None))):
+            raise PlanError(f"'{key}' tiene que ser un texto o null")
+
+
+def plan_options(spec):
+    try:
+        agents = int(spec.get("agentes", 0))
+    except (TypeError, ValueError):
+        raise PlanError("'agentes' tiene que ser un número entero")
+    if agents < 1:
+        raise PlanError("'agentes' tiene que ser al menos 1")
+    if agents > MAX_AGENTS_PER_PLAN:
+        raise PlanError(f"'agentes' no puede ser mayor de {MAX_AGENTS_PER_PLAN}")
+    check_territory(spec)
+    options = {
+        "formato": spec.get("formato", "json"),
+        "backend": spec.get("backend", "auto"),
+        "motor": spec.get("motor", pipeline.ROUTE_ENGINE),
+    }
+    for key, allowed in (("formato", OUTPUT_FORMATS), ("backend", BACKENDS), ("motor", ENGINES)):
+        if options[key] not in allowed:
+            raise PlanError(f"'{key}' no válido: {options[key]} (opciones: {', '.join(allowed)})")
+    if not any(spec.get(key) for key in JOB_KEYS):
+        raise PlanError(f"indique al menos un nivel territorial ({', '.join(JOB_KEYS)})")
+    job = {key: spec.get(key) for key in JOB_KEYS} | {"agentes": agents}
+    return job, options
+
+
+def plan_schedule(df, options):
+    # options: {"inicio": "AAAA-MM-DD", "dias": [...], "carga": 10, "reparto": "calles", "feriados": [...]}
+    days = options.get("dias", DEFAULT_WEEKDAYS)
+    unknown = [day for day in days if day not in WEEKDAYS]
+    if unknown or not days:
+        raise PlanError(f"días laborables no válidos: {unknown or days} (opciones: {', '.join(WEEKDAYS)})")
+    split = options.get("reparto", "calles")
+    if split not in SPLIT_MODES:
+        raise PlanError(f"'reparto' no válido: {split} (opciones: {', '.join(SPLIT_MODES)})")
+    try:
+        return generate_schedule(df, days, options.get("inicio") or datetime.date.today(), float(options.get("carga", 10)),
+                                 split=split, holidays=options.get("feriados", []))
+    except (TypeError, ValueError) as e:
+        raise PlanError(f"calendario: {e}")
+
+
+def plan(spec, store=None, source=None):
+    start = time.perf_counter()
+    try:
+        job, options = plan_options(spec)
+    except PlanError as e:
+        return {"estado": "error", "trabajo": spec, "error": str(e)}
+    summary = {"id": None, "trabajo": job}
+    try:
+        key = summary["id"] = job_id(job)
+        territory = job_territory(job)
+        with run(key) as report:
+            boundary = pipeline.cached_boundary(territory, store or boundary_store())
+            result = pipeline.cached_assignment(territory, job["agentes"], options["backend"], options["motor"],
+                                                store=store or boundary_store(), source=source or street_source())
+            if result is None:
+                summary["estado"] = "sin_limite" if not boundary else "sin_calles"
+            else:
+                summary.update(plan_result(result, territory, spec, options))
+        if spec.get("diagnostico"):
+            summary["etapas"] = report.to_dict()["etapas"]
+    except PlanError as e:
+        summary.update(estado="error", error=str(e))
+    except Exception as e:
+        summary.update(estado="error", error=f"{type(e).__name__}: {e}")
+    summary["segundos"] = time.perf_counter() - start
+    return summary
+
+
+def plan_result(result, territory, spec, options):
+    # La tabla se comparte con la interfaz (misma clave)
+    df = pipeline.cached_table(result, territory)
+    if spec.get("calendario") is not None:
+        df = with_schedule(df, plan_schedule(df, spec["calendario"]))
+    summary = plan_summary(result)
+    if options["formato"] == "json":
+        summary["tabla"] = frame_records(df)
+    elif options["formato"] == "geojson":
+        summary["geojson"] = assignment_geojson(result, df)
+    return summary
+
+
+def plan_summary(result):
+    street_set = result.street_set
+    return {
+        "estado": "ok",
+        "calles": len(street_set),
+        "agentes": [
+            {
+                "agente": agent + 1,
+                "color": result.colors.get(agent),
+                "calles": len(result.orders[agent]),
+                "km_calles": round(float(street_set.lengths_km[result.orders[agent]].sum()), 3),
+                "km_recorrido": round(float(result.tour_km[agent]), 3),
+                "ordenamiento": result.meta.get("motores", {}).get(agent),
+            }
+            for agent in result.agents
+        ],
+        "agrupacion": result.meta.get("clustering"),
+        "ordenamiento": result.meta.get("ordenamiento"),
+        "recorridos_reutilizados": result.meta.get("recorridos_reutilizados"),
+    }
+
+
+def plan_many(specs, concurrency=SERVICE_CONCURRENCY, store=None, source=None):
+    # Los planes con "expandir" se convierten en uno por entidad de ese nivel, conservando sus opciones
+    tasks = []
+    for spec in specs:
+        if not isinstance(spec, dict):
+            error = {"estado": "error", "trabajo": spec, "error": "cada plan tiene que ser un objeto JSON"}
+            tasks.append(lambda error=error: error)
+        elif spec.get("expandir"):
+            options = {k: v for k, v in spec.items() if k not in JOB_KEYS and k != "expandir"}
+            try:
+                check_territory(spec)
+                jobs = expand_jobs([spec])
+            except (KeyError, TypeError, ValueError) as e:
+                error = {"estado": "error", "trabajo": spec, "error": f"expandir: {e}"}
+                tasks.append(lambda error=error: error)
+                continue
+            tasks += [lambda spec=options | job: plan(spec, store, source) for job in jobs]
+        else:
+            tasks.append(lambda spec=spec: plan(spec, store, source))
+    if len(tasks) > MAX_PLANS_PER_REQUEST:
+        raise PlanError(f"demasiados planes en una petición ({len(tasks)}; máximo {MAX_PLANS_PER_REQUEST})")
+    return run_concurrently(tasks, concurrency)
+
+
+# -------------------------------
+# Servicio HTTP/JSON local
+#   GET  /salud   -> estado y ocupación de la caché compartida
+#   POST /planes  -> {"planes": [{"provincia": ..., "municipio": ..., "agentes": 3, "formato": "geojson"}, ...]}
+# -------------------------------
+def _json_default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} no es serializable")
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    concurrency = SERVICE_CONCURRENCY
+    protocol_version = "HTTP/1.1"
+
+    def send_json(self, status, body):
+        data = json.dumps(body, ensure_ascii=False, default=_json_default).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.rstrip("/") != "/salud":
+            return self.send_json(HTTPStatus.NOT_FOUND, {"error": f"ruta desconocida: {self.path}"})
+        self.send_json(HTTPStatus.OK, {"estado": "ok", "cache": shared_cache().stats()})
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/planes":
+            return self.send_json(HTTPStatus.NOT_FOUND, {"error": f"ruta desconocida: {self.path}"})
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_REQUEST_BYTES:
+            return self.send_json(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, {"error": f"petición mayor de {MAX_REQUEST_BYTES} bytes"})
+        try:
+            body = json.loads(self.rfile.read(length) or b"null")
+        except ValueError as e:
+            return self.send_json(HTTPStatus.BAD_REQUEST, {"error": f"JSON no válido: {e}"})
+        specs = body.get("planes") if isinstance(body, dict) else body
+        if not isinstance(specs, list):
+            return self.send_json(HTTPStatus.BAD_REQUEST, {"error": "se espera una lista de planes o {\"planes\": [...]}"})
+        start = time.perf_counter()
+        try:
+            results = plan_many(specs, self.concurrency)
+        except PlanError as e:
+            return self.send_json(HTTPStatus.BAD_REQUEST, {"error": str(e)})
+        self.send_json(HTTPStatus.OK, {"planes": results, "segundos": time.perf_counter() - start})
+
+
+def make_server(host=SERVICE_HOST, port=SERVICE_PORT, concurrency=SERVICE_CONCURRENCY):
+    handler = type("Handler", (ServiceHandler,), {"concurrency": concurrency})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Servicio HTTP/JSON local para generar asignaciones sin la interfaz de Streamlit.")
+    parser.add_argument("--host", default=SERVICE_HOST)
+    parser.add_argument("--port", type=int, default=SERVICE_PORT)
+    parser.add_argument("--concurrency", type=int, default=SERVICE_CONCURRENCY, help="Planes de una petición calculados a la vez")
+    args = parser.parse_args(argv)
+    server = make_server(args.host, args.port, args.concurrency)
+    print(f"Geo Agent escuchando en http://{args.host}:{server.server_port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
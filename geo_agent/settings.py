@@ -0,0 +1,22 @@
+import os
+
+# -------------------------------
+# Rutas compartidas por los distintos módulos
+# -------------------------------
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Directorio para los almacenes locales (límites, calles, índices...).
+# Se puede redirigir con la variable de entorno GEO_AGENT_CACHE_DIR.
+CACHE_DIR = os.environ.get("GEO_AGENT_CACHE_DIR", os.path.join(REPO_DIR, ".geo_agent_cache"))
+
+
+def cache_path(*parts):
+    path = os.path.join(CACHE_DIR, *parts)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+
+def cache_dir(*parts):
+    path = os.path.join(CACHE_DIR, *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
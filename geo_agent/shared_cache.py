@@ -0,0 +1,196 @@
+import os
+import sys
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import numpy as np
+
+from geo_agent.instrumentation import count
+
+# Presupuesto de memoria de la caché compartida entre todas las sesiones del proceso
+SHARED_CACHE_MAX_BYTES = int(float(os.environ.get("GEO_AGENT_SHARED_CACHE_MB", 1024)) * 1024 * 1024)
+
+
+# -------------------------------
+# Estimación del tamaño en memoria de un objeto
+# Cuenta arreglos de numpy y tablas de pandas por sus bytes reales y recorre contenedores
+# y atributos; un mismo arreglo compartido por varios objetos se cuenta una sola vez.
+# skip: ids de objetos ya contados en otra parte; no suman, pero quedan en seen al alcanzarlos.
+# -------------------------------
+def estimate_size(obj, seen=None, skip=()):
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    if id(obj) in skip:
+        return 0
+    if isinstance(obj, np.ndarray):
+        if obj.dtype == object:
+            return obj.nbytes + sum(estimate_size(item, seen, skip) for item in obj.ravel())
+        return obj.nbytes
+    if hasattr(obj, "memory_usage") and hasattr(obj, "columns"):
+        return int(obj.memory_usage(index=True, deep=True).sum())
+    if isinstance(obj, (str, bytes, bytearray, int, float, bool)) or obj is None:
+        return sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        return sys.getsizeof(obj) + sum(estimate_size(k, seen, skip) + estimate_size(v, seen, skip) for k, v in obj.items())
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return sys.getsizeof(obj) + sum(estimate_size(item, seen, skip) for item in obj)
+    if hasattr(obj, "__dict__"):
+        return sys.getsizeof(obj) + estimate_size(vars(obj), seen, skip)
+    return sys.getsizeof(obj)
+
+
+# -------------------------------
+# Caché LRU con presupuesto de bytes, compartida por hilos (sesiones de Streamlit)
+# Las claves son tuplas cuyo primer elemento es el tipo de artefacto, p. ej. ("calles", territorio).
+# Un valor que contiene a otro ya guardado (una asignación y su conjunto de calles y su límite) no
+# lo vuelve a contar: esos bytes son de la entrada que lo guardó y, si ésta sale de la caché
+# mientras otra sigue usándolo, pasan a la que lo usa.
+# -------------------------------
+class SharedCache:
+    def __init__(self, max_bytes=SHARED_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # clave -> [valor, bytes, ids de valores de otras entradas que contiene]
+        self._owners = {}  # id de un valor guardado -> [clave de la entrada que cuenta sus bytes, bytes]
+        self._pending = {}
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+        count("cache_compartida_aciertos" if entry is not None else "cache_compartida_fallos")
+        return default if entry is None else entry[0]
+
+    def put(self, key, value, size=None):
+        with self._lock:
+            self._remove(key)
+            owned = set(self._owners)
+        seen = set()
+        if size is None:
+            size = estimate_size(value, seen, skip=owned)
+        with self._lock:
+            # Un objeto mayor que todo el presupuesto no se guarda
+            if size > self.max_bytes:
+                return value
+            # Sólo se conservan las dependencias que siguen en la caché tras la estimación
+            depends = {i for i in owned & seen if i in self._owners}
+            self._remove(key)
+            self._entries[key] = [value, size, depends]
+            self._owners.setdefault(id(value), [key, size])
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+        return value
+
+    def get_or_create(self, key, factory, size=None):
+        # Si otra sesión ya está calculando la misma clave, se espera su resultado en lugar de repetirlo
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+        if entry is not None:
+            count("cache_compartida_aciertos")
+            return entry[0]
+        count("cache_compartida_fallos")
+        with self._lock:
+            future = self._pending.get(key)
+            owner = future is None
+            if owner:
+                future = self._pending[key] = Future()
+        if not owner:
+            return future.result()
+        try:
+            value = factory()
+            self.put(key, value, size)
+            future.set_result(value)
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+        return future.result()
+
+    def items(self, kind):
+        # Entradas de un tipo, de la más reciente a la más antigua; no cuentan como aciertos ni las renuevan
+        with self._lock:
+            return [(key, entry[0]) for key, entry in reversed(self._entries.items())
+                    if isinstance(key, tuple) and key and key[0] == kind]
+
+    def discard(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._owners.clear()
+            self.bytes = 0
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self.bytes -= entry[1]
+        # Los valores cuyos bytes contaba esta entrada pasan a otra que todavía los contenga
+        for value_id, owner in list(self._owners.items()):
+            if owner[0] != key:
+                continue
+            heir = next((other for other, e in self._entries.items() if value_id in e[2]), None)
+            if heir is None:
+                del self._owners[value_id]
+                continue
+            heir_entry = self._entries[heir]
+            heir_entry[2].discard(value_id)
+            heir_entry[1] += owner[1]
+            self.bytes += owner[1]
+            owner[0] = heir
+
+    def stats(self):
+        with self._lock:
+            by_kind = {}
+            for key, (_, size, _) in self._entries.items():
+                kind = key[0] if isinstance(key, tuple) and key else "otros"
+                entries, total = by_kind.get(kind, (0, 0))
+                by_kind[kind] = (entries + 1, total + size)
+            requests = self.hits + self.misses
+            return {
+                "entradas": len(self._entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "aciertos": self.hits,
+                "fallos": self.misses,
+                "expulsiones": self.evictions,
+                "tasa_aciertos": self.hits / requests if requests else 0.0,
+                "por_tipo": {kind: {"entradas": entries, "bytes": total} for kind, (entries, total) in by_kind.items()},
+            }
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_cache():
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = SharedCache()
+        return _shared
@@ -0,0 +1,103 @@
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+# -------------------------------
+# Conjunto de calles en formato columnar
+# Los puntos de todas las vías se guardan en `lat`/`lon` y la vía i ocupa el
+# rango offsets[i]:offsets[i+1]. Centroides, longitudes y rectángulos
+# envolventes se calculan una sola vez al construir el conjunto.
+# -------------------------------
+class StreetSet:
+    def __init__(self, ids, names, tags, lat, lon, offsets):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.names = np.asarray(names, dtype=object)
+        self.tags = list(tags)
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lon = np.asarray(lon, dtype=np.float64)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+
+        counts = np.diff(self.offsets)
+        starts = self.offsets[:-1]
+        # Índice de la vía a la que pertenece cada punto
+        self.point_way = np.repeat(np.arange(len(counts)), counts)
+
+        if len(counts):
+            self.centroids = np.column_stack([
+                np.add.reduceat(self.lat, starts) / counts,
+                np.add.reduceat(self.lon, starts) / counts,
+            ])
+            self.bboxes = np.column_stack([
+                np.minimum.reduceat(self.lat, starts),
+                np.minimum.reduceat(self.lon, starts),
+                np.maximum.reduceat(self.lat, starts),
+                np.maximum.reduceat(self.lon, starts),
+            ])
+            segments = haversine_km(self.lat[:-1], self.lon[:-1], self.lat[1:], self.lon[1:])
+            # Se descartan los "segmentos" que unen el último punto de una vía con el primero de la siguiente
+            segments[self.point_way[:-1] != self.point_way[1:]] = 0.0
+            self.lengths_km = np.bincount(self.point_way[:-1], weights=segments, minlength=len(counts))
+        else:
+            self.centroids = np.empty((0, 2))
+            self.bboxes = np.empty((0, 4))
+            self.lengths_km = np.empty(0)
+
+    @classmethod
+    def from_elements(cls, elements):
+        # Sólo se conservan las vías con geometría, igual que hacían el clustering y el ordenamiento
+        ids, names, tags, lat, lon, offsets = [], [], [], [], [], [0]
+        for element in elements or []:
+            geometry = element.get("geometry")
+            if not geometry:
+                continue
+            element_tags = element.get("tags", {})
+            ids.append(element.get("id", -1))
+            names.append(element_tags.get("name", "Sin nombre"))
+            tags.append(element_tags)
+            lat.extend(pt["lat"] for pt in geometry)
+            lon.extend(pt["lon"] for pt in geometry)
+            offsets.append(len(lat))
+        return cls(ids, names, tags, lat, lon, offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def coords(self, i):
+        # Coordenadas (lat, lon) de la vía i
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return np.column_stack([self.lat[start:end], self.lon[start:end]])
+
+    def subset(self, indices):
+        # Nuevo conjunto con las vías indicadas, en ese orden, sin pasar por los elementos de Overpass
+        indices = np.asarray(indices, dtype=np.int64)
+        counts = np.diff(self.offsets)[indices]
+        starts = np.repeat(self.offsets[indices], counts)
+        within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        points = starts + within
+        return StreetSet(self.ids[indices], self.names[indices], [self.tags[i] for i in indices],
+                         self.lat[points], self.lon[points], np.concatenate([[0], np.cumsum(counts)]))
+
+    def points_of(self, indices):
+        # Todos los puntos (lat, lon) de un grupo de vías
+        mask = np.isin(self.point_way, np.asarray(indices, dtype=np.int64))
+        return np.column_stack([self.lat[mask], self.lon[mask]])
+
+    def to_elements(self, indices=None):
+        # Reconstruye la forma de los elementos de Overpass
+        indices = range(len(self)) if indices is None else indices
+        return [
+            {
+                "type": "way",
+                "id": int(self.ids[i]),
+                "tags": self.tags[i],
+                "geometry": [{"lat": float(lat), "lon": float(lon)} for lat, lon in self.coords(i)],
+            }
+            for i in indices
+        ]
@@ -0,0 +1,83 @@
+import os
+import pickle
+from collections import defaultdict
+
+from geo_agent.settings import REPO_DIR, cache_path
+
+DIVISION_XLSX_PATH = os.path.join(REPO_DIR, "division_territorial.xlsx")
+DIVISION_XLSX_URL = "https://raw.githubusercontent.com/DataPicasso/geo-agent/main/division_territorial.xlsx"
+
+LEVELS = ["Provincia", "Municipio", "Distrito Municipal", "Sección", "Barrio"]
+ALL = "Todos"
+
+# Se incrementa si cambia la estructura serializada
+INDEX_VERSION = 1
+
+
+# -------------------------------
+# Índice jerárquico de la división territorial
+# Para cada prefijo de selecciones (Provincia, Municipio, ...) guarda la lista ordenada
+# de valores de cada nivel inferior, de modo que cada desplegable es una consulta O(1).
+# -------------------------------
+class TerritoryIndex:
+    def __init__(self, paths):
+        # paths: tuplas (Provincia, Municipio, Distrito Municipal, Sección, Barrio); None si falta el valor
+        self.paths = sorted(set(paths), key=lambda path: tuple("" if v is None else v for v in path))
+        options = defaultdict(set)
+        for path in self.paths:
+            for depth in range(len(LEVELS)):
+                prefix = path[:depth]
+                if None in prefix:
+                    break
+                for level in range(depth, len(LEVELS)):
+                    if path[level] is not None:
+                        options[(prefix, level)].add(path[level])
+        self._options = {key: sorted(values) for key, values in options.items()}
+
+    @staticmethod
+    def prefix(selected):
+        # Igual que la cascada original: sólo filtran las selecciones consecutivas desde la provincia
+        prefix = []
+        for value in selected:
+            if value in (None, ALL):
+                break
+            prefix.append(value)
+        return tuple(prefix)
+
+    def options(self, level, selected=()):
+        return self._options.get((self.prefix(selected), LEVELS.index(level)), [])
+
+    def paths_under(self, selected=()):
+        prefix = self.prefix(selected)
+        return [path for path in self.paths if path[:len(prefix)] == prefix]
+
+
+def read_division_paths(source):
+    import pandas as pd
+
+    df = pd.read_excel(source).reindex(columns=LEVELS)
+    df = df.astype(object).where(df.notna(), None)
+    return list(df.itertuples(index=False, name=None))
+
+
+def load_territory_index(source=None, cache_file=None):
+    # Se serializa el índice y se reutiliza mientras el Excel no cambie (fecha de modificación y tamaño)
+    source = source or (DIVISION_XLSX_PATH if os.path.exists(DIVISION_XLSX_PATH) else DIVISION_XLSX_URL)
+    if source.startswith(("http://", "https://")):
+        return TerritoryIndex(read_division_paths(source))
+    stat = os.stat(source)
+    signature = (INDEX_VERSION, os.path.abspath(source), stat.st_mtime_ns, stat.st_size)
+    cache_file = cache_file or cache_path("territory_index.pickle")
+    try:
+        with open(cache_file, "rb") as f:
+            cached = pickle.load(f)
+        if cached.get("signature") == signature:
+            return cached["index"]
+    except (FileNotFoundError, EOFError, pickle.UnpicklingError, AttributeError, KeyError, TypeError):
+        pass
+    index = TerritoryIndex(read_division_paths(source))
+    tmp = f"{cache_file}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        pickle.dump({"signature": signature, "index": index}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, cache_file)
+    return index